@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks of the pgOperations library.
+
+The suite, run_suite, creates a throwaway database with createDatabase, creates
+the table d.points, measures the workloads and drops the database. The results
+are written in json, to compare them between releases:
+
+python benchmark.py --rows 10000 --output results.json
+python benchmark.py --help
+
+The bench_* functions are run against the database of the variable dbs, "pruebas"
+by default, or the throwaway database when they are run with the option --extra.
+Each function prints the results.
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+import pgOperations as pgo
+import pgCoords
+
+dbs={'database': 'pruebas', 'user': 'postgres', 'password': 'postgres', 'host': 'localhost', 'port': '5432'}
+"""Connection parameters of the database used by the benchmarks"""
+
+def connect():
+    return pgo.pgConnect(database=dbs['database'], user=dbs['user'], password=dbs['password'], host=dbs['host'], port=dbs['port'])
+
+def best_time(function, repetitions=3):
+    """Runs function repetitions times and returns the best wall time in seconds"""
+    best=None
+    for i in xrange(repetitions):
+        t0=time.time()
+        function()
+        t=time.time() - t0
+        if best is None or t < best:
+            best=t
+    return best
+
+def bench_select_row_format(n_rows=100000, repetitions=3):
+    """
+    Compares the json way of pgSelect (array_to_json on the server and json decoding
+    on the client) with the native row formats, selecting n_rows of a wide numeric table
+    """
+    oCon=connect()
+    oCon.cursor.execute("""create temp table bench_wide as
+        select i as gid, random() as a, random() as b, random() as c, random() as d,
+               random() as e, random() as f, (random()*1000)::integer as g, i*1.5 as h
+        from generate_series(1,%s) as i""", [n_rows])
+    oOp=pgo.pgOperations(oPgConnect=oCon)
+    for row_format in ['json', 'dict', 'tuple', 'namedtuple']:
+        t=best_time(lambda: oOp.pgSelect(table_name='pg_temp.bench_wide',
+                                         string_fields_to_select='gid,a,b,c,d,e,f,g,h',
+                                         limit=None, row_format=row_format), repetitions)
+        print 'pgSelect row_format={0}: {1:.3f} s, {2:.0f} rows/s'.format(row_format, t, n_rows/t)
+    oCon.disconnect()
+
+def legacy_transform_coords_ol_to_postgis(coords_geom, splitString=','):
+    """The quadratic implementation replaced by pgCoords, to compare with it"""
+    lc=coords_geom.split(splitString)
+    sc=''
+    for i in xrange(0,len(lc),2):
+        sc=sc + ',' + lc[i] + ' ' + lc[i+1]
+    return sc[1:]
+
+def bench_coords(list_n_vertices=(10, 100, 1000, 10000, 100000, 1000000), legacy_max_vertices=10000):
+    """
+    Measures the coordinate converters with strings of 10 to 1M vertices. The legacy
+    implementation is only run until legacy_max_vertices, as it is quadratic
+    """
+    backends=['python']
+    if pgCoords.numpy is not None:
+        backends.append('numpy')
+    for n in list_n_vertices:
+        s=','.join(['{0:.3f},{1:.3f}'.format(700000 + i*0.5, 4300000 + i*0.25) for i in xrange(n)])
+        repetitions=max(1, 100000/n)
+        results=[]
+        if n <= legacy_max_vertices:
+            t=best_time(lambda: legacy_transform_coords_ol_to_postgis(s), 3)
+            results.append('legacy {0:.6f} s'.format(t))
+        for backend in backends:
+            t=best_time(lambda: pgCoords.transform_coords_ol_to_postgis(s, backend=backend), 3)
+            results.append('ol_to_postgis {0} {1:.6f} s'.format(backend, t))
+            t=best_time(lambda: pgCoords.reverseXY(s, ',', ',', backend=backend), 3)
+            results.append('reverseXY {0} {1:.6f} s'.format(backend, t))
+        batch=[s]*repetitions
+        for backend in backends:
+            t=best_time(lambda: pgCoords.transform_coords_ol_to_postgis_batch(batch, backend=backend), 3)
+            results.append('batch of {0} {1} {2:.6f} s/geometry'.format(repetitions, backend, t/repetitions))
+        print '{0} vertices: {1}'.format(n, ', '.join(results))
+
+def bench_parallel_export(n_rows=1000000, list_n_workers=(1, 2, 4, 8), repetitions=3):
+    """
+    Exports a table of n_rows points with pgParallelExport and 1 to N workers, splitting
+    it by key and by blocks. The table is not temporary, as the workers use their own connections
+    """
+    oCon=connect()
+    oCon.cursor.execute("""create table public.pgo_bench_export as
+        select i as gid, md5(i::text) as description, random()*100 as depth,
+               st_setsrid(st_makepoint(700000 + random()*1000, 4300000 + random()*1000), 25830) as geom
+        from generate_series(1,%s) as i""", [n_rows])
+    oCon.cursor.execute('alter table public.pgo_bench_export add primary key (gid)')
+    oCon.conn.commit()
+    try:
+        oOp=pgo.pgOperations(oPgConnect=oCon)
+        counter=[0]
+        def sink(rows):
+            counter[0] += len(rows)
+        for key_field in ['gid', None]:
+            t1=None
+            for n_workers in list_n_workers:
+                t=best_time(lambda: oOp.pgParallelExport(table_name='public.pgo_bench_export',
+                                                         string_fields_to_select='gid,description,depth,st_asewkb(geom)',
+                                                         key_field=key_field, n_workers=n_workers, sink=sink), repetitions)
+                if t1 is None:
+                    t1=t
+                print 'pgParallelExport key_field={0} workers={1}: {2:.3f} s, {3:.0f} rows/s, speedup {4:.2f}'.format(
+                    key_field, n_workers, t, n_rows/t, t1/t)
+    finally:
+        oCon.cursor.execute('drop table public.pgo_bench_export')
+        oCon.conn.commit()
+        oCon.disconnect()
+
+def bench_simplify(n_rows=2000, n_vertices=500, list_zooms=(None, 8, 12, 16), repetitions=3):
+    """
+    Compares the bytes transferred, and the time of pgSelect, selecting n_rows polygons of
+    n_vertices vertices in EPSG:25830 with the full geometries and simplified for several
+    zoom levels. None is the full geometry
+    """
+    oCon=connect()
+    oCon.cursor.execute("""create temp table bench_polygons as
+        select i as gid, st_setsrid(st_buffer(st_makepoint(700000 + (i % 100)*2000, 4300000 + (i / 100)*2000),
+                                              500 + random()*400, %s), 25830) as geom
+        from generate_series(1,%s) as i""", [n_vertices/4, n_rows])
+    oOp=pgo.pgOperations(oPgConnect=oCon)
+    for zoom in list_zooms:
+        result=[]
+        t=best_time(lambda: result.append(oOp.pgSelect(table_name='pg_temp.bench_polygons',
+                                                       string_fields_to_select='gid,st_asgeojson(geom)',
+                                                       limit=None, zoom=zoom)), repetitions)
+        n_bytes=len(json.dumps(result[-1]))
+        print 'pgSelect zoom={0}: {1:.3f} s, {2} bytes, {3:.0f} bytes/row'.format(zoom, t, n_bytes, float(n_bytes)/n_rows)
+    oCon.disconnect()
+
+def latencies(times):
+    """Returns a dictionary with the statistics, in milliseconds, of a list of times in seconds"""
+    times=sorted(times)
+    return {'calls': len(times), 'mean_ms': 1000*sum(times)/len(times) if times else 0.0,
+            'p50_ms': 1000*pgo.percentile(times, 50), 'p95_ms': 1000*pgo.percentile(times, 95),
+            'p99_ms': 1000*pgo.percentile(times, 99), 'max_ms': 1000*times[-1] if times else 0.0}
+
+def timed_calls(function, arguments):
+    """Calls function with each element of arguments and returns the list of times"""
+    times=[]
+    for argument in arguments:
+        t0=time.time()
+        function(argument)
+        times.append(time.time() - t0)
+    return times
+
+def point_row(i):
+    """Returns the dictionary of the row i of d.points"""
+    return {'description': 'point {0}'.format(i), 'depth': i*0.5,
+            'geom': '{0} {1}'.format(700000 + i % 1000, 4300000 + i / 1000)}
+
+def workload_insert(oOp, n_rows):
+    """pgInsert, one row and one commit by call, and pgInsertMany and pgCopyIn with n_rows rows"""
+    def insert(i):
+        oOp.pgInsert('d.points', pgo.StrFielsAndValues(point_row(i), geometry_type='POINT', epsg_to_reproject='25831'))
+    times=timed_calls(insert, xrange(n_rows))
+    r={'pgInsert': latencies(times)}
+    r['pgInsert']['rows_per_s']=n_rows/sum(times)
+    t0=time.time()
+    oOp.pgInsertMany('d.points', (point_row(i) for i in xrange(n_rows)), geometry_type='POINT', epsg_to_reproject='25831')
+    r['pgInsertMany']={'rows_per_s': n_rows/(time.time() - t0)}
+    t0=time.time()
+    oOp.pgCopyIn('d.points', (point_row(i) for i in xrange(n_rows)), geometry_type='POINT', epsg_to_reproject='25831')
+    r['pgCopyIn']={'rows_per_s': n_rows/(time.time() - t0)}
+    return r
+
+def workload_update_delete(oOp, n_calls):
+    """Latency of pgUpdate and pgDelete of one row by its primary key"""
+    gids=[row['gid'] for row in oOp.pgSelect('d.points', 'gid', limit=2*n_calls, row_format='dict')]
+    def update(gid):
+        oOp.pgUpdate('d.points', pgo.StrFielsAndValues({'depth': 1.5, 'description': 'updated'}), 'where gid=%s', [gid])
+    def delete(gid):
+        oOp.pgDelete('d.points', 'where gid=%s', [gid])
+    return {'pgUpdate': latencies(timed_calls(update, gids[:n_calls])),
+            'pgDelete': latencies(timed_calls(delete, gids[n_calls:]))}
+
+def workload_select(oOp, list_sizes, repetitions):
+    """Latency of pgSelect by number of selected rows and row format"""
+    r={}
+    for size in list_sizes:
+        for row_format in ['json', 'dict', 'tuple']:
+            times=timed_calls(lambda i: oOp.pgSelect('d.points', 'gid,description,depth,st_asgeojson(geom)',
+                                                     limit=size, row_format=row_format), xrange(repetitions))
+            r['{0}_{1}'.format(row_format, size)]=latencies(times)
+    return r
+
+def workload_str_fields_and_values(n_rows):
+    """Cost of building StrFielsAndValues objects, with coordinate strings and with sequences"""
+    rows=[point_row(i) for i in xrange(n_rows)]
+    t0=time.time()
+    for row in rows:
+        pgo.StrFielsAndValues(dict(row), geometry_type='POINT', epsg_to_reproject='25831')
+    t_wkt=time.time() - t0
+    rows=[{'description': row['description'], 'depth': row['depth'], 'geom': [float(c) for c in row['geom'].split()]} for row in rows]
+    t0=time.time()
+    for row in rows:
+        pgo.StrFielsAndValues(dict(row), geometry_type='POINT', epsg_to_reproject='25831')
+    t_wkb=time.time() - t0
+    return {'wkt_us_per_row': 1e6*t_wkt/n_rows, 'wkb_us_per_row': 1e6*t_wkb/n_rows}
+
+def workload_coords(list_n_vertices, repetitions):
+    """Time of the coordinate converters by number of vertices"""
+    backends=['python']
+    if pgCoords.numpy is not None:
+        backends.append('numpy')
+    r={}
+    for n in list_n_vertices:
+        s=','.join(['{0:.3f},{1:.3f}'.format(700000 + i*0.5, 4300000 + i*0.25) for i in xrange(n)])
+        for backend in backends:
+            r['ol_to_postgis_{0}_{1}'.format(backend, n)]={'best_s': best_time(lambda: pgCoords.transform_coords_ol_to_postgis(s, backend=backend), repetitions)}
+            r['reverseXY_{0}_{1}'.format(backend, n)]={'best_s': best_time(lambda: pgCoords.reverseXY(s, ',', ',', backend=backend), repetitions)}
+    return r
+
+def run_suite(n_rows=10000, repetitions=10, keep=False):
+    """
+    Creates the database of the variable dbs, runs the workloads with n_rows rows and drops
+    the database, unless keep is True
+    @return: a dictionary with the information of the environment and the results of each workload
+    """
+    pgo.createDatabase(dbs)
+    try:
+        oCon=connect()
+        try:
+            oCon.cursor.execute('create schema d')
+            oCon.cursor.execute("create table d.points (gid serial primary key, description varchar, depth double precision, geom geometry('POINT',25831))")
+            oCon.cursor.execute('select version(), postgis_full_version()')
+            pg_version, postgis_version=oCon.cursor.fetchone()
+            oCon.conn.commit()
+            oOp=pgo.pgOperations(oPgConnect=oCon)
+            results={}
+            results['insert']=workload_insert(oOp, n_rows)
+            results['update_delete']=workload_update_delete(oOp, min(n_rows, 1000))
+            results['select']=workload_select(oOp, [1, 100, min(n_rows, 10000)], repetitions)
+            results['str_fields_and_values']=workload_str_fields_and_values(n_rows)
+            results['coords']=workload_coords([10, 1000, 100000], repetitions)
+        finally:
+            oCon.disconnect()
+    finally:
+        if not keep:
+            pgo.dropDatabase(dbs)
+    return {'date': datetime.datetime.utcnow().isoformat(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'postgresql': pg_version, 'postgis': postgis_version,
+            'rows': n_rows, 'repetitions': repetitions, 'results': results}
+
+def main(args=None):
+    parser=argparse.ArgumentParser(description='Benchmarks of the pgOperations library')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--database', default='pgo_bench_{0}'.format(os.getpid()),
+                        help='name of the throwaway database. It must not exist')
+    parser.add_argument('--rows', type=int, default=10000, help='number of rows of the workloads')
+    parser.add_argument('--repetitions', type=int, default=10, help='calls of each select workload')
+    parser.add_argument('--output', help='json file for the results. By default they are written in the standard output')
+    parser.add_argument('--keep', action='store_true', help='do not drop the database at the end')
+    parser.add_argument('--extra', action='store_true', help='run also the bench_* functions in the database. It is dropped at the end, unless --keep is given')
+    args=parser.parse_args(args)
+    dbs.update(database=args.database, user=args.user, password=args.password, host=args.host, port=args.port)
+    #the messages of the library go to stderr, so the standard output is only the json
+    stdout=sys.stdout
+    sys.stdout=sys.stderr
+    try:
+        results=run_suite(args.rows, args.repetitions, args.keep or args.extra)
+        if args.extra:
+            try:
+                bench_select_row_format()
+                bench_coords()
+                bench_parallel_export()
+                bench_simplify()
+            finally:
+                if not args.keep:
+                    pgo.dropDatabase(dbs)
+    finally:
+        sys.stdout=stdout
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
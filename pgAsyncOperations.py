@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+'''
+Asynchronous version of the class pgOperations, to use in web servers
+based on an asyncio event loop, without blocking the loop.
+
+It uses the asynchronous connections of psycopg2 (async_=1). The waits
+are integrated in the event loop with add_reader/add_writer.
+
+This library uses Python 2.7, so the event loop is the one of the library
+trollius (https://pypi.org/project/trollius/), the asyncio port for
+Python 2.7. The coroutines use "yield From(...)" instead of "yield from ..."
+
+The statements are formed with the same functions than pgOperations
+(build_insert, build_update, ...), and the values with the same
+StrFielsAndValues objects, so the results are the same. The asynchronous
+connections are always in autocommit mode, so there is not transactions.
+
+Example of use:
+
+import trollius as asyncio
+from trollius import From
+import pgOperations as pgo
+import pgAsyncOperations as pgao
+
+@asyncio.coroutine
+def main(loop):
+    oPool=pgao.AsyncPgConnectPool(minconn=2, maxconn=10, database="pruebas", user="postgres",
+                                  password="postgres", host="localhost", port="5432", loop=loop)
+    yield From(oPool.open())
+    oOp=pgao.AsyncPgOperations(oPool)
+    d={"description": "water well", "depth": 12.15, "geom": "100 200"}
+    oStrFielsAndValues=pgo.StrFielsAndValues(d=d, geom_field_name="geom", epsg='25830',
+                                             geometry_type="POINT", epsg_to_reproject="25831")
+    resp=yield From(oOp.pgInsert(nom_tabla="d.points", oStrFielsAndValues=oStrFielsAndValues, str_fields_returning="gid"))
+    print resp
+    resp=yield From(oOp.pgSelect(table_name="d.points", string_fields_to_select='gid,depth,description'))
+    print resp
+    oPool.close()
+
+loop=asyncio.get_event_loop()
+loop.run_until_complete(main(loop))
+'''
+
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import trollius as asyncio
+from trollius import From, Return
+
+import pgOperations as pgo
+
+@asyncio.coroutine
+def wait(conn, loop):
+    """
+    Waits, without blocking the event loop, until the asynchronous connection
+    conn finishes its current operation
+    """
+    while True:
+        state=conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        future=asyncio.Future(loop=loop)
+        def ready():
+            if not future.done():
+                future.set_result(None)
+        fd=conn.fileno()
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fd, ready)
+            remove=loop.remove_reader
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(fd, ready)
+            remove=loop.remove_writer
+        else:
+            raise psycopg2.OperationalError("Bad state from poll: {0}".format(state))
+        try:
+            yield From(future)
+        finally:
+            remove(fd)
+
+def discard(conn):
+    """
+    Cancels the query that the asynchronous connection conn is executing, if any,
+    and closes it. It is used when a coroutine is cancelled, or fails, in the middle
+    of a query, because the connection can not be used again until the query ends
+    """
+    if conn.closed:
+        return
+    if conn.isexecuting():
+        try:
+            conn.cancel()
+        except psycopg2.Error:
+            pass
+    conn.close()
+
+class AsyncPgConnectPool():
+    """
+    Pool of asynchronous connections. Many coroutines can share a few connections:
+    when all of them are in use, the coroutines wait, without blocking the loop,
+    until a connection is returned to the pool
+    """
+    def __init__(self, minconn, maxconn, database, user, password, host, port, loop=None):
+        """
+        Initialises the pool. The connections are opened with the coroutine open
+        @type minconn: integer
+        @param minconn: number of connections opened by the coroutine open
+        @type maxconn: integer
+        @param maxconn: maximum number of connections
+        @param loop: the event loop. None to use the default loop
+        """
+        self.minconn=minconn
+        self.maxconn=maxconn
+        self.params=dict(database=database, user=user, password=password, host=host, port=port)
+        self.loop=loop or asyncio.get_event_loop()
+        self.semaphore=asyncio.Semaphore(maxconn, loop=self.loop)
+        self.idle=[]
+        self.n_connections=0
+        self.checkouts=0
+        self.wait_time=0.0
+        self.exhaustions=0
+
+    @asyncio.coroutine
+    def connect(self):
+        """Opens a new asynchronous connection"""
+        conn=psycopg2.connect(async_=1, **self.params)
+        yield From(wait(conn, self.loop))
+        raise Return(conn)
+
+    @asyncio.coroutine
+    def open(self):
+        """Opens minconn connections"""
+        for i in xrange(self.minconn - len(self.idle)):
+            conn=yield From(self.connect())
+            self.idle.append(conn)
+            self.n_connections += 1
+
+    @asyncio.coroutine
+    def getconn(self):
+        """
+        Takes a connection of the pool, and opens it if needed
+        @return: a psycopg2 asynchronous connection
+        """
+        t0=time.time()
+        if self.semaphore.locked():
+            self.exhaustions += 1
+        yield From(self.semaphore.acquire())
+        self.checkouts += 1
+        self.wait_time += time.time() - t0
+        while self.idle:
+            conn=self.idle.pop()
+            if not conn.closed:
+                raise Return(conn)
+            self.n_connections -= 1
+        try:
+            conn=yield From(self.connect())
+        except:
+            self.semaphore.release()
+            raise
+        self.n_connections += 1
+        raise Return(conn)
+
+    def putconn(self, conn):
+        """
+        Returns a connection to the pool. If it is still executing a query it is closed
+        """
+        if not conn.closed and conn.isexecuting():
+            discard(conn)
+        if conn.closed:
+            self.n_connections -= 1
+        else:
+            self.idle.append(conn)
+        self.semaphore.release()
+
+    def stats(self):
+        """
+        Returns a dictionary with the statistics of the pool. See pgOperations.pgConnectPool.stats
+        """
+        return {'checkouts': self.checkouts, 'wait_time': self.wait_time,
+                'exhaustions': self.exhaustions, 'connections': self.n_connections,
+                'idle': len(self.idle), 'in_use': self.n_connections - len(self.idle)}
+
+    def close(self):
+        """Closes the idle connections"""
+        for conn in self.idle:
+            conn.close()
+        self.n_connections -= len(self.idle)
+        self.idle=[]
+
+class AsyncPgOperations():
+    """
+    Asynchronous version of the class pgOperations. The methods are coroutines, with
+    the same parameters and results than the methods of pgOperations
+    """
+    query=None
+    """Store the last query - class variable"""
+    def __init__(self, oPool, hooks=None, verbose=False):
+        """
+        @type oPool: AsyncPgConnectPool
+        @param oPool: the pool of asynchronous connections
+        @param hooks: list of functions called after each statement. See pgOperations.addHook
+        @param verbose: if True, the statements are printed
+        """
+        self.oPool=oPool
+        self.hooks=list(hooks or [])
+        if verbose:
+            self.hooks.append(pgo.print_hook)
+        self.metadata_ttl=300
+        self.metadata={}
+        self.postgis=None
+
+    def addHook(self, hook):
+        """Adds a hook. See pgOperations.addHook"""
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        """Removes a function added with addHook"""
+        self.hooks.remove(hook)
+
+    @asyncio.coroutine
+    def execute(self, cons, values=None, fetch=False):
+        """
+        Executes a statement in a connection of the pool
+        @param fetch: if True, fetches the selected or returned rows
+        @return: a tuple (rows, rowcount, field names). rows is None if fetch is False
+        """
+        self.query=cons
+        conn=yield From(self.oPool.getconn())
+        try:
+            cursor=conn.cursor()
+            try:
+                t0=time.time()
+                cursor.execute(cons, values)
+                yield From(wait(conn, self.oPool.loop))
+                if self.hooks:
+                    elapsed=time.time() - t0
+                    n_params=0 if values is None else len(values)
+                    for hook in self.hooks:
+                        hook(cons, n_params, cursor.rowcount, elapsed)
+                rows=None
+                field_names=None
+                if fetch:
+                    rows=cursor.fetchall()
+                    field_names=[d[0] for d in cursor.description]
+                raise Return((rows, cursor.rowcount, field_names))
+            except Return:
+                raise
+            except:
+                #cancelled (e.g. wait_for timeout) in the middle of the query
+                if not conn.closed and conn.isexecuting():
+                    discard(conn)
+                raise
+            finally:
+                if not conn.closed:
+                    cursor.close()
+        finally:
+            self.oPool.putconn(conn)
+
+    @asyncio.coroutine
+    def pgInsert(self, nom_tabla, oStrFielsAndValues, str_fields_returning=None):
+        """Inserts a row in a table. See pgOperations.pgInsert"""
+        cons, values, key=pgo.build_insert(nom_tabla, oStrFielsAndValues, str_fields_returning)
+        rows, rowcount, field_names=yield From(self.execute(cons, values, str_fields_returning <> None))
+        raise Return(rows)
+
+    @asyncio.coroutine
+    def pgUpdate(self, table_name, oStrFielsAndValues, cond_where=None, list_values_cond_where=None):
+        """Updates a table. See pgOperations.pgUpdate"""
+        cons, values, key=pgo.build_update(table_name, oStrFielsAndValues, cond_where, list_values_cond_where)
+        rows, rowcount, field_names=yield From(self.execute(cons, values))
+        raise Return(rowcount)
+
+    @asyncio.coroutine
+    def pgDelete(self, table_name, cond_where=None, list_values_cond_where=None):
+        """Deletes rows of a table. See pgOperations.pgDelete"""
+        cons, values, key=pgo.build_delete(table_name, cond_where, list_values_cond_where)
+        rows, rowcount, field_names=yield From(self.execute(cons, values))
+        raise Return(rowcount)
+
+    @asyncio.coroutine
+    def pgSelect(self, table_name, string_fields_to_select, cond_where='', list_val_cond_where=[], limit=100, row_format='json'):
+        """Select rows of a table. See pgOperations.pgSelect"""
+        cons, values=pgo.build_select(table_name, string_fields_to_select, cond_where, list_val_cond_where, limit, row_format)
+        rows, rowcount, field_names=yield From(self.execute(cons, values, True))
+        raise Return(pgo.decode_select(rows, field_names, row_format))
+
+    @asyncio.coroutine
+    def getTableMetadata(self, table_name):
+        """Returns the metadata of a table. See pgOperations.getTableMetadata"""
+        d=self.metadata.get(table_name)
+        if d is None or (self.metadata_ttl is not None and time.time() - d['time'] > self.metadata_ttl):
+            if self.postgis is None:
+                rows, rowcount, field_names=yield From(self.execute(pgo.POSTGIS_QUERY, fetch=True))
+                self.postgis=rows[0][0]
+            cons, values=pgo.build_metadata_query(list_tables=[table_name], postgis=self.postgis)
+            rows, rowcount, field_names=yield From(self.execute(cons, values, True))
+            self.metadata.update(pgo.decode_metadata(rows, [table_name]))
+            d=self.metadata.get(table_name)
+        if d['field_names'] is None:
+            raise Return(None)
+        raise Return(d)
+
+    @asyncio.coroutine
+    def getTableFieldNames(self, nomTable, changeGeomBySt_asgeojosonGeom=True, nomGeometryField='geom'):
+        """Retuns a list with the table field names. See pgOperations.getTableFieldNames"""
+        d=yield From(self.getTableMetadata(nomTable))
+        raise Return(pgo.field_names_list(d, changeGeomBySt_asgeojosonGeom, nomGeometryField))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+'''
+Conversions of coordinate strings, from OpenLayers, from the land registry GML,
+... to the strings 'x y, x y, ...' used by the class pgOperations.StrFielsAndValues
+
+All the functions run in linear time. They have two backends:
+    - 'python': the coordinates are not converted to numbers, the output has
+      exactly the same digits than the input. Default backend
+    - 'numpy': the coordinates are parsed with numpy. The output numbers are
+      written with repr, so 100 becomes 100.0. Only available if numpy is installed
+
+The functions transform_coords_ol_to_postgis, transform_coords_land_registry_gml_to_postgis
+and reverseXY are also available in the module pgOperations
+'''
+
+import array
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+def check_pairs(n):
+    """Raises an exception if n, the number of coordinates of a string, is odd"""
+    if n % 2:
+        raise Exception("The number of coordinates is odd: {0}".format(n))
+
+def check_backend(backend):
+    """Raises an exception if the backend is not available"""
+    if backend == 'numpy':
+        if numpy is None:
+            raise Exception("The backend numpy needs the numpy library")
+    elif backend <> 'python':
+        raise Exception("Unsuported backend " + backend)
+
+def parse_coords(str_coords, separator=',', backend='python'):
+    """
+    Converts a string 'x,y,x,y,...' to numbers
+    @type  str_coords: string
+    @param str_coords: coordinates separated by separator
+    @type  separator: string
+    @param separator: coordinates separator. e.g ',' or ' '
+    @return: with the backend python, an array.array('d') [x, y, x, y, ...]
+        With the backend numpy, a numpy array with a row (x, y) for each point.
+        Both of them can be used as geometry values in StrFielsAndValues
+    """
+    check_backend(backend)
+    if backend == 'numpy':
+        values=numpy.fromstring(str_coords, dtype=float, sep=separator)
+        check_pairs(len(values))
+        return values.reshape(-1, 2)
+    values=array.array('d', [float(c) for c in str_coords.split(separator)])
+    check_pairs(len(values))
+    return values
+
+def format_coords(coords, separator_xy=' ', separator_points=','):
+    """
+    Converts a sequence of numbers [x, y, x, y, ...], or a numpy array with a row
+    for each point, to a string 'x y,x y,...'
+    @param separator_xy: separator between the x and the y of a point
+    @param separator_points: separator between points
+    """
+    if numpy is not None and isinstance(coords, numpy.ndarray):
+        coords=coords.ravel().tolist()
+    values=[repr(float(c)) for c in coords]
+    return separator_points.join([x + separator_xy + y for x, y in itertools.izip(values[0::2], values[1::2])])
+
+def transform_coords_ol_to_postgis(coords_geom, splitString=',', backend='python'):
+    """
+    Receives a string coordinate like 'x,y,x,y,x,y,....' from openlayers
+    Returns a string like 'x y, x y, x y, ....'
+    """
+    check_backend(backend)
+    if backend == 'numpy':
+        return format_coords(parse_coords(coords_geom, splitString, 'numpy'))
+    lc=coords_geom.split(splitString)
+    check_pairs(len(lc))
+    return ','.join([x + ' ' + y for x, y in itertools.izip(lc[0::2], lc[1::2])])
+
+def transform_coords_land_registry_gml_to_postgis(coords_geom, splitString=' ', backend='python'):
+    """
+    Receives a string coordinate like 'x,y x,y x,y,....' from land registry gml
+    Returns a string like 'x y, x y, x y, ....'
+    """
+    check_backend(backend)
+    return transform_coords_ol_to_postgis(coords_geom.replace(splitString, ','), ',', backend)
+
+def reverseXY (strCoords, separatorIn, separatorOut, backend='python'):
+    """
+    Changes the x y order for y x in a string
+    Receives a string with 'x,y,x,y,...' 'or x y x y ...' and retuns a string with 'y,x,y,x,...'
+        or 'y x y x ...'
+    @type  strCoords: string
+    @param strCoords: Coordenates string comma or space separated:
+        'x,y,x,y,...' or 'x y x y ...'
+    @type  separatorIn: string
+    @param separatorIn: Coodinates separator in the input string. Can be ',' or ' '
+    @type  separatorOut: string
+    @param separatorOut: Coodinates eparator in the output string. Can be ',' or ' '
+    @return: a string with the 'y,x,y,x,...' or 'y x y x ...', depending of the separator
+
+    Example of use:
+        s='1,2,1,2,1,2'
+        print reverseXY(s,',',',')
+        '2,1,2,1,2,1'
+    """
+    check_backend(backend)
+    if backend == 'numpy':
+        coords=parse_coords(strCoords, separatorIn, 'numpy')[:, ::-1]
+        return format_coords(coords, separatorOut, separatorOut)
+    coords=strCoords.split(separatorIn)
+    check_pairs(len(coords))
+    r=[None]*len(coords)
+    r[0::2]=coords[1::2]
+    r[1::2]=coords[0::2]
+    return separatorOut.join(r)
+
+def split_parsed(str_list, separator):
+    """
+    Parses with numpy, in only one call, all the coordinate strings of a list
+    @return: a list with a numpy array, with a row (x, y) for each point, for each string
+    """
+    values=numpy.fromstring(separator.join(str_list), dtype=float, sep=separator)
+    counts=[s.count(separator) + 1 for s in str_list]
+    for n in counts:
+        check_pairs(n)
+    return numpy.split(values, numpy.cumsum(counts)[:-1])
+
+def transform_coords_ol_to_postgis_batch(list_coords_geom, splitString=',', backend='python'):
+    """
+    Converts a list of strings 'x,y,x,y,...' from openlayers. See transform_coords_ol_to_postgis
+    With the backend numpy all the strings are parsed in only one call
+    @return: a list of strings 'x y, x y, ...'
+    """
+    check_backend(backend)
+    if backend == 'numpy':
+        return [format_coords(coords) for coords in split_parsed(list_coords_geom, splitString)]
+    return [transform_coords_ol_to_postgis(coords_geom, splitString) for coords_geom in list_coords_geom]
+
+def transform_coords_land_registry_gml_to_postgis_batch(list_coords_geom, splitString=' ', backend='python'):
+    """
+    Converts a list of strings 'x,y x,y ...' from land registry gml.
+    See transform_coords_land_registry_gml_to_postgis
+    @return: a list of strings 'x y, x y, ...'
+    """
+    check_backend(backend)
+    if backend == 'numpy':
+        list_coords_geom=[coords_geom.replace(splitString, ',') for coords_geom in list_coords_geom]
+        return transform_coords_ol_to_postgis_batch(list_coords_geom, ',', 'numpy')
+    return [transform_coords_land_registry_gml_to_postgis(coords_geom, splitString) for coords_geom in list_coords_geom]
+
+def reverseXY_batch(list_str_coords, separatorIn, separatorOut, backend='python'):
+    """
+    Changes the x y order for y x in a list of strings. See reverseXY
+    @return: a list of strings
+    """
+    check_backend(backend)
+    if backend == 'numpy':
+        return [format_coords(coords.reshape(-1, 2)[:, ::-1], separatorOut, separatorOut)
+                for coords in split_parsed(list_str_coords, separatorIn)]
+    return [reverseXY(str_coords, separatorIn, separatorOut) for str_coords in list_str_coords]
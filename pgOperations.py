@@ -24,9 +24,38 @@ create table d.points (gid serial primary key, description varchar, depth double
 
 import psycopg2
 import psycopg2.extensions
+import psycopg2.pool
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT 
 
 import json
+import itertools
+import collections
+import contextlib
+import functools
+import threading
+import time
+import re
+import weakref
+import random
+import struct
+import array
+import binascii
+import math
+import base64
+import sys
+import Queue
+import hashlib
+import os
+import cPickle
+import select
+
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+import pgCoords
+from pgCoords import transform_coords_ol_to_postgis, transform_coords_land_registry_gml_to_postgis, reverseXY
 
 psycopg2.extensions.register_type(psycopg2.extensions.UNICODE)
 psycopg2.extensions.register_type(psycopg2.extensions.UNICODEARRAY)
@@ -37,9 +66,12 @@ class pgConnect():
     """psycopg2 connection object - class variable"""
     cursor=None
     """psycopg2 connection object - class variable"""
+    params=None
+    """Dictionary with the connection parameters, to open other connections - class variable"""
     
     def __init__(self, database,user,password,host,port):
         """Initialise the class variables"""
+        self.params=dict(database=database, user=user, password=password, host=host, port=port)
         d=self.__connect(database, user, password, host, port)
         self.conn=d['conn']
         self.cursor=d['cursor']
@@ -60,6 +92,22 @@ class pgConnect():
         d['cursor']=cursor
         return d
     
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Context manager that gives this object, with the properties conn and cursor.
+        It has the same use than the method connection of the class pgConnectPool
+        """
+        yield self
+
+    def reconnect(self):
+        """Closes the connection, if it is open, and opens it again with the same parameters"""
+        if not self.conn.closed:
+            self.conn.close()
+        d=self.__connect(**self.params)
+        self.conn=d['conn']
+        self.cursor=d['cursor']
+
     def disconnect(self):
         """Closes the connection"""
         self.cursor.close()
@@ -67,6 +115,288 @@ class pgConnect():
         print 'Disconected'
 
 
+class pgPooledConnection():
+    """Connection of a pgConnectPool, with its own cursor"""
+    conn=None
+    """psycopg2 connection object"""
+    cursor=None
+    """psycopg2 cursor object, only used while the connection is out of the pool"""
+
+    def __init__(self, conn):
+        self.conn=conn
+        self.cursor=conn.cursor()
+
+
+class pgConnectPool():
+    """
+    Pool of connections with the database. It is thread safe, so a pgOperations
+    object created with a pgConnectPool can be used from several threads at the same time.
+    Each thread gets its own connection, and its own cursor, for each method call
+
+    Example of use:
+    import pgOperations as pgo
+    oPool=pgo.pgConnectPool(minconn=2, maxconn=10, database="pruebas", user="postgres",
+                            password="postgres", host="localhost", port="5432")
+    oOp=pgo.pgOperations(oPgConnect=oPool)
+    #now oOp can be used from the threads of a web server
+
+    with oPool.connection() as oCon:
+        oCon.cursor.execute('select count(*) from d.points')
+        print oCon.cursor.fetchall()
+
+    print oPool.stats()
+    {'checkouts': 1, 'wait_time': 0.0, 'exhaustions': 0, 'connections': 2, 'idle': 2, 'in_use': 0}
+    """
+    def __init__(self, minconn, maxconn, database, user, password, host, port, timeout=None):
+        """
+        Opens minconn connections
+        @type minconn: integer
+        @param minconn: number of connections opened at the begining
+        @type maxconn: integer
+        @param maxconn: maximum number of connections. If all of them are in use,
+            the threads wait until a connection is returned to the pool
+        @type timeout: float
+        @param timeout: maximum number of seconds to wait for a connection. None to wait
+            indefinitely. If the timeout is reached, a psycopg2.pool.PoolError is raised
+        """
+        self.minconn=minconn
+        self.maxconn=maxconn
+        self.timeout=timeout
+        self.params=dict(database=database, user=user, password=password, host=host, port=port)
+        self.idle=[]
+        self.n_connections=0
+        self.condition=threading.Condition()
+        self.checkouts=0
+        self.wait_time=0.0
+        self.exhaustions=0
+        self.closed=False
+        for i in xrange(minconn):
+            self.idle.append(psycopg2.connect(**self.params))
+            self.n_connections += 1
+
+    def getconn(self):
+        """
+        Takes a connection of the pool. If there is not any idle connection, and there are
+        less than maxconn connections, a new connection is opened. Otherwise waits
+        @return: a psycopg2 connection
+        """
+        t0=time.time()
+        with self.condition:
+            if self.closed:
+                raise psycopg2.pool.PoolError("connection pool is closed")
+            if not self.idle and self.n_connections >= self.maxconn:
+                self.exhaustions += 1
+            while not self.idle and self.n_connections >= self.maxconn:
+                if self.timeout is None:
+                    self.condition.wait()
+                else:
+                    remaining=self.timeout - (time.time() - t0)
+                    if remaining <= 0:
+                        raise psycopg2.pool.PoolError("connection pool exhausted")
+                    self.condition.wait(remaining)
+            self.checkouts += 1
+            self.wait_time += time.time() - t0
+            while self.idle:
+                conn=self.idle.pop()
+                if not conn.closed:
+                    return conn
+                self.n_connections -= 1
+            self.n_connections += 1
+        try:
+            return psycopg2.connect(**self.params)
+        except:
+            with self.condition:
+                self.n_connections -= 1
+                self.condition.notify()
+            raise
+
+    def putconn(self, conn):
+        """
+        Returns a connection to the pool. If it has an open transaction, it is rolled back
+        """
+        if not conn.closed and conn.get_transaction_status() <> psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+        with self.condition:
+            if self.closed and not conn.closed:
+                conn.close()
+            if conn.closed:
+                self.n_connections -= 1
+            else:
+                self.idle.append(conn)
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Context manager that takes a connection of the pool and returns it at the end
+        @return: a pgPooledConnection object, with the properties conn and cursor
+        """
+        oCon=pgPooledConnection(self.getconn())
+        try:
+            yield oCon
+        finally:
+            oCon.cursor.close()
+            self.putconn(oCon.conn)
+
+    def stats(self):
+        """
+        Returns a dictionary with the statistics of the pool:
+            checkouts: number of connections taken
+            wait_time: total seconds waited to take the connections
+            exhaustions: number of times that a connection was requested and all were in use
+            connections: number of open connections
+            idle: number of connections in the pool
+            in_use: number of connections out of the pool
+        """
+        with self.condition:
+            return {'checkouts': self.checkouts, 'wait_time': self.wait_time,
+                    'exhaustions': self.exhaustions, 'connections': self.n_connections,
+                    'idle': len(self.idle), 'in_use': self.n_connections - len(self.idle)}
+
+    def disconnect(self):
+        """Closes the idle connections. The connections in use are closed when they are returned"""
+        with self.condition:
+            for conn in self.idle:
+                conn.close()
+            self.n_connections -= len(self.idle)
+            self.idle=[]
+            self.closed=True
+
+
+def connection_failed(oCon, e):
+    """
+    Returns True if the exception e, raised while using oCon, means that the connection
+    with the server failed, and not only the statement. The statements cancelled by the
+    server, by statement_timeout or by a conflict with the recovery of a replica, do not
+    close the connection
+    @param oCon: object with the properties conn and cursor. None if the connection
+        could not be opened
+    """
+    if oCon is None or isinstance(e, psycopg2.InterfaceError):
+        return True
+    if isinstance(e, (psycopg2.extensions.QueryCanceledError, psycopg2.extensions.TransactionRollbackError)):
+        return False
+    return bool(oCon.conn.closed)
+
+class ReplicaSet():
+    """
+    Replicas of the database where pgOperations sends the reads. Each read is sent to
+    the next replica (round robin), or to the replica with the least latency. A replica
+    where a read fails with a connection error is ejected for retry_seconds, and then it
+    is used again if its health check, 'select 1', works. It is thread safe
+    """
+    latency_weight=0.2
+    """Weight of the last read in the moving average of the latency of a replica - class variable"""
+    def __init__(self, replicas, balancing='round_robin', retry_seconds=30):
+        """
+        @type replicas: list
+        @param replicas: list of pgConnect or pgConnectPool objects, one for each replica
+        @type balancing: string
+        @param balancing: 'round_robin' or 'least_latency'
+        @type retry_seconds: float
+        @param retry_seconds: seconds that a failed replica is not used
+        """
+        if balancing not in ('round_robin', 'least_latency'):
+            raise Exception("Unsuported balancing " + balancing)
+        self.replicas=list(replicas)
+        self.balancing=balancing
+        self.retry_seconds=retry_seconds
+        self.lock=threading.Lock()
+        self.counter=itertools.count()
+        self.latencies=[None]*len(self.replicas)
+        self.ejected_until=[None]*len(self.replicas)
+        self.reads=[0]*len(self.replicas)
+        self.failures=[0]*len(self.replicas)
+
+    def choose(self, exclude=()):
+        """
+        Returns the index of the replica for the next read, or None if all of them
+        are ejected or excluded. The ejected replicas whose time has passed are
+        checked before using them
+        @param exclude: indexes of the replicas that can not be used
+        """
+        now=time.time()
+        with self.lock:
+            candidates=[i for i in xrange(len(self.replicas)) if i not in exclude]
+            available=[i for i in candidates if self.ejected_until[i] is None]
+            expired=[i for i in candidates if self.ejected_until[i] is not None and self.ejected_until[i] <= now]
+        for i in expired:
+            if self.check(i):
+                available.append(i)
+        if not available:
+            return None
+        if self.balancing == 'least_latency':
+            with self.lock:
+                return min(available, key=lambda i: self.latencies[i] or 0.0)
+        available.sort()
+        return available[next(self.counter) % len(available)]
+
+    def record(self, i, elapsed):
+        """Stores the seconds that a read took in the replica i"""
+        with self.lock:
+            self.reads[i] += 1
+            if self.latencies[i] is None:
+                self.latencies[i]=elapsed
+            else:
+                self.latencies[i] += self.latency_weight*(elapsed - self.latencies[i])
+
+    def eject(self, i):
+        """Stops using the replica i for retry_seconds"""
+        with self.lock:
+            self.failures[i] += 1
+            self.ejected_until[i]=time.time() + self.retry_seconds
+
+    def check(self, i):
+        """
+        Health check of the replica i. It executes 'select 1', reconnecting first if
+        the connection is a pgConnect. The replica is ejected if it fails, and
+        readmitted if it works
+        @return: True if the replica works
+        """
+        oReplica=self.replicas[i]
+        oCon=None
+        try:
+            if self.ejected_until[i] is not None and hasattr(oReplica, 'reconnect'):
+                oReplica.reconnect()
+            t0=time.time()
+            with oReplica.connection() as oCon:
+                try:
+                    oCon.cursor.execute('select 1')
+                    oCon.cursor.fetchone()
+                finally:
+                    oCon.conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if connection_failed(oCon, e):
+                self.eject(i)
+                return False
+        with self.lock:
+            self.ejected_until[i]=None
+            if self.latencies[i] is None:
+                self.latencies[i]=time.time() - t0
+        return True
+
+    def checkAll(self):
+        """
+        Health check of all the replicas
+        @return: a list with True or False for each replica
+        """
+        return [self.check(i) for i in xrange(len(self.replicas))]
+
+    def stats(self):
+        """
+        Returns a list with a dictionary for each replica, with the keys reads, failures,
+        latency (moving average in seconds, None if it was not used) and ejected (boolean)
+        """
+        now=time.time()
+        with self.lock:
+            return [{'reads': self.reads[i], 'failures': self.failures[i], 'latency': self.latencies[i],
+                     'ejected': self.ejected_until[i] is not None and self.ejected_until[i] > now}
+                    for i in xrange(len(self.replicas))]
+
+
 class pgOperations():
     """
     Perform the most common operations with PostGIS:
@@ -76,8 +406,545 @@ class pgOperations():
     """Store the last query - class variable"""
     oPgConnect=None
     """pgConnection object - class variable"""
-    def __init__(self, oPgConnect):
+    def __fieldNames(self):
+        return getattr(self.local, 'field_names', None)
+    field_names=property(__fieldNames)
+    """List with the field names of the last select of this thread with the row_format 'tuple' - class variable"""
+    named_cursor_counter=itertools.count()
+    """Counter to give a different name to each server side cursor - class variable"""
+    prepared_statements=0
+    """Maximum number of prepared statements by connection - class variable"""
+    metadata_ttl=300
+    """Seconds that the table metadata is stored in the cache - class variable"""
+    autocommit=True
+    """If True each write operation commits - class variable"""
+    group_commit_ops=None
+    """Number of write operations in each commit, in group commit mode - class variable"""
+    group_commit_ms=None
+    """Maximum milliseconds between commits, in group commit mode - class variable"""
+    tile_cache=None
+    """TileCache object where the tiles of the method pgTile are stored - class variable"""
+    result_cache=None
+    """ResultCache object where the results of the method pgSelect are stored - class variable"""
+    replicas=None
+    """ReplicaSet object with the replicas where the reads are sent - class variable"""
+    sticky_reads=True
+    """If True the reads inside a transaction are done in the primary - class variable"""
+    postgis=None
+    """True if the database has PostGIS, None until the first metadata read - class variable"""
+    def __init__(self, oPgConnect, prepared_statements=0, metadata_ttl=300,
+                 autocommit=True, group_commit_ops=None, group_commit_ms=None,
+                 hooks=None, verbose=False, tile_cache=None, result_cache=None,
+                 replicas=None, replica_balancing='round_robin', sticky_reads=True, replica_retry_seconds=30):
+        """
+        @type oPgConnect: pgConnect or pgConnectPool
+        @param oPgConnect: the connection with the database. With a pgConnectPool
+            each method call uses a connection of the pool, so the same
+            pgOperations object can be used from several threads
+        @type prepared_statements: integer
+        @param prepared_statements: maximum number of statements prepared in each connection.
+            If it is greater than 0, the statements of pgInsert, pgUpdate and pgDelete are
+            prepared in the server, with 'prepare', the first time they are used, and the next
+            calls with the same table, fields, expressions and conditions only send
+            'execute' with the values. The least recently used statement is deallocated
+            when the limit is reached. 0 to not prepare the statements
+        @type metadata_ttl: float
+        @param metadata_ttl: seconds that the table metadata is stored in the cache.
+            None to store it until the method invalidateMetadata is called
+        @type autocommit: boolean
+        @param autocommit: if True, pgInsert, pgUpdate, pgDelete, ... commit after each call.
+            If False, they do not commit, and you have to call the methods commit or rollback.
+            In both cases, the operations inside a block 'with oOp.transaction():' are
+            commited at the end of the block
+        @type group_commit_ops: integer
+        @param group_commit_ops: group commit mode. If it is not None, and autocommit is True,
+            the write operations commit every group_commit_ops operations. Call the method
+            flush to commit the last operations
+        @type group_commit_ms: float
+        @param group_commit_ms: group commit mode. If it is not None, and autocommit is True,
+            the write operations commit when the first operation not commited was done more
+            than group_commit_ms milliseconds ago. A timer commits them at that time, also if
+            there are not more operations. If the commit of the timer fails, the exception is
+            raised in the next call of the thread
+        @type hooks: list
+        @param hooks: list of functions called after each statement. See the method addHook
+        @type verbose: boolean
+        @param verbose: if True, the statements are printed. It is the same than adding the hook print_hook
+        @type tile_cache: TileCache
+        @param tile_cache: cache of the tiles made with the method pgTile. None to not cache the tiles
+        @type result_cache: ResultCache
+        @param result_cache: cache of the results of the method pgSelect. None to not cache the results.
+            If the cache has a notification channel, it starts listening it. The cache is not
+            used inside a transaction, or while there are operations not commited
+        @type replicas: list
+        @param replicas: list of pgConnect or pgConnectPool objects connected with replicas of
+            the database of oPgConnect, the primary. pgSelect, pgSelectPage, pgTile and the
+            table metadata (getTableFieldNames, ...) are read from the replicas, the other
+            methods use the primary. If a read in a replica fails with a connection error,
+            the replica is ejected and the read is repeated in other replica, or in the primary.
+            None to read from the primary
+        @type replica_balancing: string
+        @param replica_balancing: 'round_robin' to use the replicas by turns, or 'least_latency'
+            to use the replica with the least moving average of the latency
+        @type sticky_reads: boolean
+        @param sticky_reads: if True, the reads of a thread that has a connection of the primary
+            reserved, because it is in a transaction or it has operations not commited, are done
+            in the primary, so they see its own writes
+        @type replica_retry_seconds: float
+        @param replica_retry_seconds: seconds that an ejected replica is not used. Then it is
+            used again if its health check works
+        """
         self.oPgConnect=oPgConnect
+        self.prepared_statements=prepared_statements
+        self.prepared_caches=weakref.WeakKeyDictionary()
+        self.prepared_caches_lock=threading.Lock()
+        self.metadata_ttl=metadata_ttl
+        self.metadata={}
+        self.autocommit=autocommit
+        self.group_commit_ops=group_commit_ops
+        self.group_commit_ms=group_commit_ms
+        self.local=threading.local()
+        self.hooks=list(hooks or [])
+        if verbose:
+            self.hooks.append(print_hook)
+        self.tile_cache=tile_cache
+        self.result_cache=result_cache
+        if result_cache is not None and result_cache.channel is not None:
+            result_cache.listen(oPgConnect.params)
+        if replicas:
+            self.replicas=ReplicaSet(replicas, replica_balancing, replica_retry_seconds)
+        self.sticky_reads=sticky_reads
+
+    def __execute(self, oCon, cons, values=None, key=None, cursor=None):
+        """
+        Executes a statement in the cursor of oCon, and calls the hooks
+        @param key: tuple that identifies the shape of the statement. If it is not None,
+            and the prepared statements are enabled, the statement is prepared
+        @param cursor: cursor to use instead of the cursor of oCon
+        """
+        if cursor is None:
+            cursor=oCon.cursor
+        t0=time.time()
+        if key is not None and self.prepared_statements > 0:
+            with self.prepared_caches_lock:
+                oCache=self.prepared_caches.get(oCon.conn)
+                if oCache is None:
+                    oCache=PreparedStatementCache(self.prepared_statements)
+                    self.prepared_caches[oCon.conn]=oCache
+            oCache.execute(cursor, key, cons, values)
+        elif values is None:
+            cursor.execute(cons)
+        else:
+            cursor.execute(cons, values)
+        self.__callHooks(cons, values, cursor.rowcount, t0)
+
+    def __callHooks(self, cons, values, rowcount, t0):
+        """
+        Calls the hooks with the statement template, the number of parameters,
+        the number of rows and the seconds since t0
+        """
+        if self.hooks:
+            elapsed=time.time() - t0
+            n_params=0 if values is None else len(values)
+            for hook in self.hooks:
+                hook(cons, n_params, rowcount, elapsed)
+
+    def addHook(self, hook):
+        """
+        Adds a function that is called after each statement executed, with the parameters
+        (template, n_params, rowcount, elapsed):
+            template: the statement, with %s instead of the values
+            n_params: number of values
+            rowcount: number of rows affected or selected, -1 if unknown
+            elapsed: wall time in seconds
+        The functions print_hook, and the objects of the class QueryStatsCollector, are hooks
+
+        Example of use:
+            oStats=pgo.QueryStatsCollector()
+            oOp.addHook(oStats)
+            ...
+            print oStats.report()
+        """
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        """Removes a function added with addHook"""
+        self.hooks.remove(hook)
+
+    def preparedStatementsStats(self):
+        """
+        Returns a dictionary with the statistics of the prepared statements of all the connections:
+            hits: number of executions of statements already prepared
+            misses: number of statements prepared
+            evictions: number of statements deallocated to not exceed the limit
+            prepared: number of statements prepared now
+        """
+        d={'hits': 0, 'misses': 0, 'evictions': 0, 'prepared': 0}
+        with self.prepared_caches_lock:
+            list_caches=self.prepared_caches.values()
+        for oCache in list_caches:
+            d['hits'] += oCache.hits
+            d['misses'] += oCache.misses
+            d['evictions'] += oCache.evictions
+            d['prepared'] += len(oCache.statements)
+        return d
+
+    @contextlib.contextmanager
+    def __connection(self, write=False):
+        """
+        Context manager that gives the object, with the properties conn and cursor,
+        to use in a method call. If this thread has a connection reserved, because it is
+        in a transaction, it is used. Otherwise a connection is taken for the call
+        @param write: True if the call writes. In group commit mode, or with autocommit=False,
+            the writes reserve the connection until the commit. The reads do not reserve it
+        """
+        oCon=self.__lockReserved()
+        if oCon is None and write and (not self.autocommit or self.group_commit_ops is not None or self.group_commit_ms is not None):
+            self.__reserve()
+            oCon=self.__lockReserved()
+        if oCon is not None:
+            lock=self.local.reservation['lock']
+            try:
+                yield oCon
+            finally:
+                lock.release()
+        elif not write:
+            with self.oPgConnect.connection() as oCon:
+                yield oCon
+        else:
+            try:
+                with self.oPgConnect.connection() as oCon:
+                    yield oCon
+            finally:
+                self.__callAfterCommit()
+
+    def __read(self, function):
+        """
+        Calls function(oCon) with a connection of a replica, or of the primary if there
+        are not replicas, all of them are ejected, or the thread has a connection reserved
+        and sticky_reads is True. If the connection with the replica fails, it is ejected
+        and the function is called again with other connection. The errors of the
+        statement, e.g. statement_timeout, are raised
+        @param function: function that receives an object with the properties conn and
+            cursor, and only reads
+        @return: the value returned by function
+        """
+        if self.replicas is None or (self.sticky_reads and self.__reserved()):
+            with self.__connection() as oCon:
+                return function(oCon)
+        tried=[]
+        while True:
+            i=self.replicas.choose(tried)
+            if i is None:
+                with self.__connection() as oCon:
+                    return function(oCon)
+            tried.append(i)
+            t0=time.time()
+            oCon=None
+            try:
+                with self.replicas.replicas[i].connection() as oCon:
+                    try:
+                        result=function(oCon)
+                    finally:
+                        oCon.conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if not connection_failed(oCon, e):
+                    raise
+                self.replicas.eject(i)
+                continue
+            self.replicas.record(i, time.time() - t0)
+            return result
+
+    def replicaStats(self):
+        """
+        Returns a list with the statistics of each replica. See ReplicaSet.stats.
+        None if there are not replicas
+        """
+        if self.replicas is None:
+            return None
+        return self.replicas.stats()
+
+    def checkReplicas(self):
+        """
+        Health check of all the replicas. The replicas that fail are ejected, and
+        the ejected replicas that work are used again
+        @return: a list with True or False for each replica. None if there are not replicas
+        """
+        if self.replicas is None:
+            return None
+        return self.replicas.checkAll()
+
+    def __reserved(self):
+        """Returns True if this thread has a connection reserved, so it can see writes not commited"""
+        reservation=getattr(self.local, 'reservation', None)
+        return reservation is not None and not reservation['released']
+
+    def __reserve(self):
+        """
+        Reserves a connection for this thread, until the transaction is commited or rolled back.
+        The reservation is a dictionary shared with the group commit timer, see __commitLater
+        """
+        cm=self.oPgConnect.connection()
+        oCon=cm.__enter__()
+        self.local.reservation={'oCon': oCon, 'cm': cm, 'lock': threading.RLock(), 'timer': None,
+                                'released': False, 'error': None, 'after_commit': []}
+        self.local.oCon=oCon
+        self.local.pending_ops=0
+        self.local.pending_since=None
+        return oCon
+
+    def __lockReserved(self):
+        """
+        Returns the reserved connection of this thread, with the lock of the reservation
+        acquired, so the group commit timer does not commit in the middle of an operation.
+        None if the thread has not a connection reserved. If the timer commited and
+        released the connection, the reservation is forgotten, and if the commit
+        failed its exception is raised
+        """
+        reservation=getattr(self.local, 'reservation', None)
+        if reservation is None:
+            return None
+        reservation['lock'].acquire()
+        if not reservation['released']:
+            return reservation['oCon']
+        reservation['lock'].release()
+        self.__forget()
+        if reservation['error'] is not None:
+            raise reservation['error']
+        return None
+
+    def __forget(self):
+        """Removes the reservation of this thread"""
+        self.local.reservation=None
+        self.local.oCon=None
+        self.local.pending_ops=0
+        self.local.pending_since=None
+
+    def __release(self):
+        """
+        Returns the reserved connection of this thread
+        """
+        reservation=self.local.reservation
+        self.__forget()
+        self.__releaseReservation(reservation)
+
+    def __releaseReservation(self, reservation):
+        """
+        Returns the connection of a reservation, and calls the functions stored with __afterCommit
+        """
+        reservation['released']=True
+        if reservation['timer'] is not None:
+            reservation['timer'].cancel()
+        try:
+            reservation['cm'].__exit__(None, None, None)
+        finally:
+            list_functions=reservation['after_commit']
+            reservation['after_commit']=[]
+            for function in list_functions:
+                function()
+
+    def __commitLater(self, reservation):
+        """
+        Called by the group commit timer, in other thread, group_commit_ms milliseconds
+        after the first operation not commited. It commits and releases the connection,
+        if the thread that reserved it has not done it yet. The exception of the commit,
+        if any, is raised in the next call of that thread
+        """
+        with reservation['lock']:
+            if reservation['released']:
+                return
+            try:
+                reservation['oCon'].conn.commit()
+            except psycopg2.Error as e:
+                reservation['error']=e
+            finally:
+                self.__releaseReservation(reservation)
+
+    def __invalidateTiles(self, oCon, table_name, cond_where=None, list_values_cond_where=None, oStrFielsAndValues=None):
+        """
+        Removes from the tile cache the tiles of table_name in the extent of the rows that
+        a write operation is going to change: the rows that satisfy cond_where, and the
+        geometry of oStrFielsAndValues. If both are None, all the tiles of the table are removed.
+        The extent is queried now, only if there are tiles of the table in the cache, but the
+        tiles are removed after the commit, so they are not made again with the old rows.
+        See the method __afterCommit
+        """
+        if self.tile_cache is None:
+            return
+        for geom_field_name in self.tile_cache.geometryFields(table_name):
+            if cond_where is None and oStrFielsAndValues is None:
+                self.__afterCommit(functools.partial(self.tile_cache.invalidate, table_name, None, geom_field_name))
+                continue
+            r=build_extent_query(table_name, geom_field_name, cond_where, list_values_cond_where, oStrFielsAndValues)
+            if r is None:
+                continue
+            self.__execute(oCon, r[0], r[1])
+            bbox=oCon.cursor.fetchone()
+            if bbox is not None and bbox[0] is not None:
+                self.__afterCommit(functools.partial(self.tile_cache.invalidate, table_name, bbox, geom_field_name))
+
+    def __afterCommit(self, function):
+        """
+        Stores a function, without parameters, that removes from the caches the data changed
+        by a write operation. The functions are called when the connection used by the
+        operation ends its transaction: when the reserved connection is released, or at
+        the end of the write method if the connection is not reserved
+        """
+        reservation=getattr(self.local, 'reservation', None)
+        if reservation is not None:
+            reservation['after_commit'].append(function)
+            return
+        if getattr(self.local, 'after_commit', None) is None:
+            self.local.after_commit=[]
+        self.local.after_commit.append(function)
+
+    def __callAfterCommit(self):
+        """Calls the functions stored with the method __afterCommit"""
+        list_functions=getattr(self.local, 'after_commit', None)
+        if not list_functions:
+            return
+        self.local.after_commit=None
+        for function in list_functions:
+            function()
+
+    def __invalidateResults(self, oCon, table_name):
+        """
+        Removes from the result cache the results of the selects of table_name, after
+        a write operation, and again after the commit, as other threads could read the
+        old rows meanwhile. If the cache has a notification channel, the other processes
+        are notified when the write operation is commited
+        """
+        if self.result_cache is None:
+            return
+        self.result_cache.invalidate(table_name)
+        self.__afterCommit(functools.partial(self.result_cache.invalidate, table_name))
+        if self.result_cache.channel is not None:
+            cursor=oCon.conn.cursor()
+            try:
+                self.__execute(oCon, 'select pg_notify(%s, %s)', [self.result_cache.channel, table_name], cursor=cursor)
+            finally:
+                cursor.close()
+
+    def __commit(self, oCon):
+        """
+        Commits after a write operation, if it is not in a transaction block and the
+        mode is autocommit. In group commit mode, only commits every group_commit_ops
+        operations or group_commit_ms milliseconds
+        """
+        if getattr(self.local, 'depth', 0) > 0 or not self.autocommit:
+            return
+        if self.group_commit_ops is None and self.group_commit_ms is None:
+            oCon.conn.commit()
+            return
+        self.local.pending_ops += 1
+        if self.local.pending_since is None:
+            self.local.pending_since=time.time()
+            if self.group_commit_ms is not None:
+                timer=threading.Timer(self.group_commit_ms/1000.0, self.__commitLater, [self.local.reservation])
+                timer.daemon=True
+                self.local.reservation['timer']=timer
+                timer.start()
+        if (self.group_commit_ops is not None and self.local.pending_ops >= self.group_commit_ops) or \
+                (self.group_commit_ms is not None and (time.time() - self.local.pending_since)*1000 >= self.group_commit_ms):
+            self.commit()
+
+    def commit(self):
+        """
+        Commits the open transaction of this thread. It is necessary with autocommit=False,
+        and to commit the last operations in group commit mode
+        """
+        if getattr(self.local, 'depth', 0) > 0:
+            raise Exception("Inside a transaction block the commit is done at the end of the block")
+        oCon=self.__lockReserved()
+        if oCon is not None:
+            lock=self.local.reservation['lock']
+            try:
+                oCon.conn.commit()
+            finally:
+                self.__release()
+                lock.release()
+
+    flush=commit
+
+    def rollback(self):
+        """
+        Rolls back the open transaction of this thread
+        """
+        if getattr(self.local, 'depth', 0) > 0:
+            raise Exception("Inside a transaction block raise an exception to roll back")
+        oCon=self.__lockReserved()
+        if oCon is not None:
+            lock=self.local.reservation['lock']
+            try:
+                oCon.conn.rollback()
+            finally:
+                self.__release()
+                lock.release()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Context manager to do several operations in only one transaction. The operations
+        do not commit, and at the end of the block there is a commit, or a rollback
+        if there was an exception. The blocks can be nested: the inner blocks
+        are savepoints, so an exception in an inner block only rolls back its operations
+
+        Example of use:
+        oOp=pgo.pgOperations(oPgConnect=oCon)
+        with oOp.transaction():
+            oOp.pgInsert(nom_tabla="d.points", oStrFielsAndValues=oStrFielsAndValues1)
+            oOp.pgUpdate(table_name="d.points", oStrFielsAndValues=oStrFielsAndValues2,
+                         cond_where="where gid=%s", list_values_cond_where=[1])
+            try:
+                with oOp.transaction():
+                    oOp.pgDelete(table_name="d.points", cond_where="where gid=%s", list_values_cond_where=[2])
+                    raise Exception("Only the delete is rolled back")
+            except Exception:
+                pass
+        """
+        depth=getattr(self.local, 'depth', 0)
+        if depth == 0:
+            oCon=self.__lockReserved()
+            if oCon is None:
+                self.__reserve()
+                oCon=self.__lockReserved()
+            #the lock is held during all the block, so the group commit timer does not commit
+            lock=self.local.reservation['lock']
+            self.local.depth=1
+            try:
+                try:
+                    yield self
+                except:
+                    exc_info=sys.exc_info()
+                    self.local.depth=0
+                    try:
+                        oCon.conn.rollback()
+                    except psycopg2.Error:
+                        #the exception of the block is raised, not the one of the rollback
+                        pass
+                    finally:
+                        self.__release()
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                self.local.depth=0
+                try:
+                    oCon.conn.commit()
+                finally:
+                    self.__release()
+            finally:
+                lock.release()
+        else:
+            cursor=self.local.oCon.cursor
+            savepoint='pgo_savepoint_{0}'.format(depth)
+            cursor.execute('savepoint ' + savepoint)
+            self.local.depth=depth + 1
+            try:
+                yield self
+            except:
+                self.local.depth=depth
+                cursor.execute('rollback to savepoint ' + savepoint)
+                raise
+            self.local.depth=depth
+            cursor.execute('release savepoint ' + savepoint)
         
     def pgInsert(self, nom_tabla, oStrFielsAndValues, str_fields_returning=None):
         """
@@ -106,14 +973,13 @@ class pgOperations():
             str_field_names="depth, description, geom", 
             list_field_values=[12.15, "water well","POINT(100 200)"], 
             str_s_values="%s,%s,st_transform(st_geometryfromtext(%s,25830),25831)")
-        oOp=pgo.pgOperations(oPgConnect=oCon)
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
         resp=oOp.pgInsert(nom_tabla="d.points", oStrFielsAndValues=oStrFielsAndValuesBase, str_fields_returning="gid")
         print resp
         
         The result is:
         Connected
-        Inserting
-        insert into d.points (depth, description, geom) values (%s,%s,st_transform(st_geometryfromtext(%s,25830),25831)) returning gid
+        Query: insert into d.points (depth, description, geom) values (%s,%s,st_transform(st_geometryfromtext(%s,25830),25831)) returning gid
         [(1,)]
         
         2. Example of use with dictionaries, and automatic generation of expressions
@@ -137,31 +1003,376 @@ class pgOperations():
         geom,description
         ['POINT(100 200)', 'water well']
         st_transform(st_geometryfromtext(%s,25830),25831),%s
-        Inserting
-        insert into d.points (geom,description) values (st_transform(st_geometryfromtext(%s,25830),25831),%s) returning gid
+        Query: insert into d.points (geom,description) values (st_transform(st_geometryfromtext(%s,25830),25831),%s) returning gid
         [(2,)]
         """
-        conn=self.oPgConnect.conn
-        cursor=self.oPgConnect.cursor
-        
-        str_field_names=oStrFielsAndValues.str_field_names
-        list_field_values=oStrFielsAndValues.list_field_values
-        str_s_values=oStrFielsAndValues.str_s_values
-
-        #cons_ins='insert into {0} ({1}) values (%s,st_geometryfromtext(%s,25830))'.format(nom_tabla, string_fields_to_set)
-        cons_ins='insert into {0} ({1}) values ({2})'.format(nom_tabla, str_field_names, str_s_values)
-        
-        if str_fields_returning <> None:
-            cons_ins =cons_ins + ' returning ' + str_fields_returning
-        print 'Inserting'
-        print cons_ins
-        self.query=cons_ins
-        cursor.execute(cons_ins,list_field_values)
-        conn.commit()
-        if str_fields_returning <> None:
-            returning=cursor.fetchall()
+        with self.__connection(write=True) as oCon:
+            cursor=oCon.cursor
+            cons_ins, list_field_values, key=build_insert(nom_tabla, oStrFielsAndValues, str_fields_returning)
+            self.__invalidateTiles(oCon, nom_tabla, oStrFielsAndValues=oStrFielsAndValues)
+            self.query=cons_ins
+            self.__execute(oCon, cons_ins, list_field_values, key)
+            returning=None
+            if str_fields_returning <> None:
+                returning=cursor.fetchall()
+            self.__invalidateResults(oCon, nom_tabla)
+            self.__commit(oCon)
             return returning
-    
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager that queues the pgInsert, pgUpdate and pgDelete operations done
+        with the pgBatch object it gives. At the end of the block, all of them are sent
+        to the server in only one round trip, and commited together, so in high latency
+        links they take about the time of one operation. If one of them fails, none is done.
+        If there is an exception inside the block nothing is sent.
+        The results, in the order of the operations, are stored in the properties results
+        and rowcounts of the pgBatch object. The returning values are decoded from json,
+        so dates and times are strings.
+        With a tile cache, all the tiles of the tables written are removed after the commit
+
+        Example of use:
+        with oOp.batch() as oBatch:
+            oBatch.pgInsert(nom_tabla="d.points", oStrFielsAndValues=oStrFielsAndValues1, str_fields_returning="gid")
+            oBatch.pgUpdate(table_name="d.points", oStrFielsAndValues=oStrFielsAndValues2,
+                            cond_where="where gid=%s", list_values_cond_where=[1])
+            oBatch.pgDelete(table_name="d.points", cond_where="where gid=%s", list_values_cond_where=[2])
+        print oBatch.results
+        [[(3,)], 1, 1]
+        """
+        oBatch=pgBatch()
+        yield oBatch
+        if not oBatch.operations:
+            oBatch.results=[]
+            oBatch.rowcounts=[]
+            return
+        cons, values=build_batch(oBatch.operations)
+        list_tables=sorted(set([d['table_name'] for d in oBatch.operations]))
+        with self.__connection(write=True) as oCon:
+            #all the tiles of the tables are removed, to not query the extent of each
+            #operation, which would add a round trip for each one
+            for table_name in list_tables:
+                self.__invalidateTiles(oCon, table_name)
+            self.query=cons
+            #values is always a list, even empty, so the %% of cons are unescaped
+            self.__execute(oCon, cons, values)
+            rows=oCon.cursor.fetchall()
+            for table_name in list_tables:
+                self.__invalidateResults(oCon, table_name)
+            self.__commit(oCon)
+        oBatch.results, oBatch.rowcounts=decode_batch(rows, oBatch.operations)
+
+    def pgInsertMany(self, nom_tabla, rows, str_fields_returning=None, page_size=500,
+                     list_fields_to_remove=None, geom_field_name='geom', epsg='25830',
+                     geometry_type='POLYGON', epsg_to_reproject=None, template=None):
+        """
+        Inserts many rows in a table. The rows are sent in pages of page_size rows,
+        each page in only one statement 'insert into ... values (...),(...),...'.
+        Only one commit is done, at the end, when all the pages have been inserted
+
+        @param nom_tabla: table name included the schema. Ej. "d.linde".
+            Mandatory specify the schema name: public.tablename
+        @type  nom_tabla: string
+        @param rows: iterable of dictionaries or StrFielsAndValues objects. All the rows
+            have to have the same field names, in the same order, and the same expressions.
+            The dictionaries are converted to StrFielsAndValues objects with the parameters
+            list_fields_to_remove, geom_field_name, epsg, geometry_type and epsg_to_reproject,
+            so the geometries are inserted as in the method pgInsert. The dictionaries are not modified
+        @type rows: list
+        @param str_fields_returning: string with the field names, of the inserted rows, to return.
+            ej: "gid, date", will return the field gid and date
+        @type str_fields_returning: string
+        @param page_size: maximum number of rows to insert in each statement
+        @type page_size: integer
+        @param list_fields_to_remove: see the class StrFielsAndValues. Only used with dictionaries
+        @param geom_field_name: see the class StrFielsAndValues. Only used with dictionaries
+        @param epsg: see the class StrFielsAndValues. Only used with dictionaries
+        @param geometry_type: see the class StrFielsAndValues. Only used with dictionaries
+        @param epsg_to_reproject: see the class StrFielsAndValues. Only used with dictionaries
+        @type template: RowTemplate
+        @param template: if it is not None, the dictionaries are converted with this template,
+            instead of with StrFielsAndValues, and the parameters list_fields_to_remove,
+            geom_field_name, epsg, geometry_type and epsg_to_reproject are not used
+
+        @return:
+            if str_fields_returning is None, returns the number of inserted rows
+            if str_fields_returning is 'gid, date' returns a list with a tuple with the gid and date
+                of each inserted row, in the same order than the rows
+
+        Example of use:
+
+        import pgOperations as pgo
+        oCon=pgo.pgConnect(database="pruebas", user="postgres", password="postgres", host="localhost", port="5432")
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
+        rows=[{"description": "water well", "depth": 12.15, "geom": "100 200"},
+              {"description": "water well2", "depth": 8.5, "geom": "300 300"}]
+        resp=oOp.pgInsertMany(nom_tabla="d.points", rows=rows, str_fields_returning="gid",
+                              geom_field_name="geom", epsg='25830', geometry_type="POINT",
+                              epsg_to_reproject="25831")
+        print resp
+
+        The result is:
+        Query: insert into d.points (geom,depth,description) values (st_transform(st_geometryfromtext(%s,25830),25831),%s,%s),(st_transform(st_geometryfromtext(%s,25830),25831),%s,%s) returning gid
+        [(3,), (4,)]
+        """
+        with self.__connection(write=True) as oCon:
+            cursor=oCon.cursor
+            self.__invalidateTiles(oCon, nom_tabla)
+
+            returning=[]
+            n=0
+            for oFirst, list_values, n_rows in self.__pages(rows, page_size, list_fields_to_remove,
+                                                            geom_field_name, epsg, geometry_type, epsg_to_reproject, template):
+                str_row='(' + oFirst.str_s_values + ')'
+                cons_ins='insert into {0} ({1}) values {2}'.format(nom_tabla, oFirst.str_field_names, ','.join([str_row]*n_rows))
+                if str_fields_returning <> None:
+                    cons_ins =cons_ins + ' returning ' + str_fields_returning
+                self.query=cons_ins
+                self.__execute(oCon, cons_ins, list_values)
+                if str_fields_returning <> None:
+                    returning.extend(cursor.fetchall())
+                n += n_rows
+            self.__invalidateResults(oCon, nom_tabla)
+            self.__commit(oCon)
+            if str_fields_returning <> None:
+                return returning
+            return n
+
+    def __pages(self, rows, page_size, list_fields_to_remove=None, geom_field_name='geom',
+                epsg='25830', geometry_type='POLYGON', epsg_to_reproject=None, template=None):
+        """
+        Groups the rows in pages of page_size rows. The dictionaries are converted with
+        the template, if it is not None, or with StrFielsAndValues
+        @return: a generator of tuples (oFirst, list_values, n). oFirst is the StrFielsAndValues
+            object of the first row, list_values is a list with the values of all the rows of
+            the page, one row after other, and n is the number of rows of the page
+        """
+        oFirst=None
+        list_values=[]
+        n=0
+        for row in rows:
+            if isinstance(row, dict) and template is not None:
+                row=template.bind(row)
+            elif isinstance(row, dict):
+                row=StrFielsAndValues(d=dict(row), list_fields_to_remove=list_fields_to_remove,
+                                      geom_field_name=geom_field_name, epsg=epsg,
+                                      geometry_type=geometry_type, epsg_to_reproject=epsg_to_reproject)
+            if oFirst is None:
+                oFirst=row
+            elif row.str_field_names <> oFirst.str_field_names or row.str_s_values <> oFirst.str_s_values:
+                raise Exception("All the rows must have the same field names and expressions: " + row.str_field_names)
+            list_values.extend(row.list_field_values)
+            n += 1
+            if n == page_size:
+                yield oFirst, list_values, n
+                list_values=[]
+                n=0
+        if n > 0:
+            yield oFirst, list_values, n
+
+    def pgCopyIn(self, table_name, iterable_of_dicts, geom_field_name='geom', epsg='25830',
+                 epsg_to_reproject=None, geometry_type='POLYGON', list_fields_to_remove=None):
+        """
+        Loads many rows in a table with the command 'copy ... from stdin'. The rows are
+        read from the iterable while they are sent to the server, so the memory used
+        does not depend on the number of rows. Only one commit is done, at the end
+
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+            Mandatory specify the schema name: public.tablename
+        @type iterable_of_dicts: iterable
+        @param iterable_of_dicts: list or generator of dictionaries key-value, where the keys are
+            the name fields and the values the value fields. The field names are taken from
+            the first dictionary. The missing keys in the next dictionaries are loaded as null.
+            e.g: {"depth":12.15, "description":"water well", "geom":"100 200"}
+            The geometry field value is a string coordinates "x y, x y, ...", or a sequence
+            of coordinates, as in the class StrFielsAndValues. The sequences are sent in hexadecimal EWKB.
+            The lists of the other fields are sent as arrays, and the dictionaries as json
+        @type geom_field_name: string
+        @param geom_field_name: name of the geometry field in the table. e.g "geom"
+        @type epsg: string
+        @param epsg: epsg code of the coordinates. e.g "25830"
+        @type epsg_to_reproject: string
+        @param epsg_to_reproject: epsg code to reproject the geometries. e.g: "25831". None if
+            you do not want to reproject. The rows are copied into a temporary table,
+            and then all the geometries are reprojected and inserted in the table with only
+            one statement 'insert into ... select ..., st_transform(geom, 25831) from ...'
+        @type geometry_type: string
+        @param geometry_type: POINT, LINESTRING, POLYGON, MULTIPOINT, MULTILINESTRING, MULTIPOLYGON
+        @type list_fields_to_remove: list of strings
+        @param list_fields_to_remove: list with the filed names to exclude. For example ['gid']
+        @return: the number of loaded rows
+
+        Example of use:
+
+        import pgOperations as pgo
+        oCon=pgo.pgConnect(database="pruebas", user="postgres", password="postgres", host="localhost", port="5432")
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
+        rows=({"description": "point {0}".format(i), "depth": i, "geom": "{0} 200".format(i)} for i in xrange(1000000))
+        resp=oOp.pgCopyIn(table_name="d.points", iterable_of_dicts=rows, geom_field_name="geom",
+                          epsg='25830', epsg_to_reproject="25831", geometry_type="POINT")
+        print resp
+
+        The result is:
+        Query: copy pg_temp.pgo_copy_in (depth,geom,description) from stdin
+        Query: insert into d.points (depth,geom,description) select depth,st_transform(geom,25831),description from pg_temp.pgo_copy_in
+        1000000
+        """
+        with self.__connection(write=True) as oCon:
+            it=iter(iterable_of_dicts)
+            try:
+                first=next(it)
+            except StopIteration:
+                return 0
+            self.__invalidateTiles(oCon, table_name)
+            list_field_names=[key for key in first.keys() if list_fields_to_remove is None or key not in list_fields_to_remove]
+            str_field_names=','.join(list_field_names)
+
+            if epsg_to_reproject is None:
+                cons='copy {0} ({1}) from stdin'.format(table_name, str_field_names)
+                n=self.__copyRows(oCon, cons, itertools.chain([first], it), list_field_names,
+                                  geom_field_name, epsg, geometry_type)
+            else:
+                self.__createStaging(oCon, 'pgo_copy_in', table_name, list_field_names, geom_field_name)
+                cons='copy pg_temp.pgo_copy_in ({0}) from stdin'.format(str_field_names)
+                n=self.__copyRows(oCon, cons, itertools.chain([first], it), list_field_names,
+                                  geom_field_name, epsg, geometry_type)
+                str_select=staging_select(list_field_names, geom_field_name, epsg_to_reproject)
+                cons='insert into {0} ({1}) select {2} from pg_temp.pgo_copy_in'.format(table_name, str_field_names, str_select)
+                self.__execute(oCon, cons)
+                self.__execute(oCon, 'drop table pg_temp.pgo_copy_in')
+            self.__invalidateResults(oCon, table_name)
+            self.__commit(oCon)
+            self.query=cons
+            return n
+
+    def pgUpsertMany(self, table_name, rows, conflict_fields, update_fields=None, skip_unchanged=True,
+                     geom_field_name='geom', epsg='25830', epsg_to_reproject=None, geometry_type='POLYGON',
+                     list_fields_to_remove=None):
+        """
+        Inserts or updates many rows in a table. The rows are loaded, with the command
+        'copy ... from stdin', in a temporary table, and merged in the table with only
+        one statement 'insert into ... select ... on conflict (...) do update ...'.
+        Only one commit is done, at the end
+
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+            Mandatory specify the schema name: public.tablename
+        @type rows: iterable
+        @param rows: list or generator of dictionaries key-value, as in the method pgCopyIn.
+            Two rows can not have the same values in the conflict_fields
+        @type conflict_fields: string
+        @param conflict_fields: fields, comma separated, with an unique index or constraint.
+            The rows with the same values than a row of the table update it. e.g: 'gid'
+        @type update_fields: string
+        @param update_fields: fields, comma separated, updated when a row exists. None to
+            update all the fields of the rows except the conflict_fields. '' to not
+            update the existing rows
+        @type skip_unchanged: boolean
+        @param skip_unchanged: if True, the existing rows are only updated if any of the
+            update_fields has changed, so the unchanged rows do not leave dead tuples.
+            The geometries are compared by their binary representation, as the = operator
+            of PostGIS before 2.4 only compares the bounding boxes
+        @param geom_field_name: see the method pgCopyIn
+        @param epsg: see the method pgCopyIn
+        @param epsg_to_reproject: see the method pgCopyIn
+        @param geometry_type: see the method pgCopyIn
+        @param list_fields_to_remove: see the method pgCopyIn
+        @return: a dictionary with the number of inserted, updated and unchanged rows.
+            e.g: {'inserted': 2, 'updated': 1, 'unchanged': 997}
+
+        Example of use:
+
+        import pgOperations as pgo
+        oCon=pgo.pgConnect(database="pruebas", user="postgres", password="postgres", host="localhost", port="5432")
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
+        rows=[{"gid": 1, "description": "water well", "depth": 12.15, "geom": "100 200"},
+              {"gid": 2, "description": "water well2", "depth": 8.5, "geom": "300 300"}]
+        resp=oOp.pgUpsertMany(table_name="d.points", rows=rows, conflict_fields="gid",
+                              geom_field_name="geom", epsg='25830', geometry_type="POINT",
+                              epsg_to_reproject="25831")
+        print resp
+
+        The result is:
+        Query: create temp table pgo_upsert as select gid,depth,geom,description from d.points with no data
+        Query: alter table pg_temp.pgo_upsert alter column geom type geometry
+        Query: copy pg_temp.pgo_upsert (gid,depth,geom,description) from stdin
+        Query: with r as (insert into d.points as t (gid,depth,geom,description) select gid,depth,st_transform(geom,25831),description from pg_temp.pgo_upsert on conflict (gid) do update set depth = excluded.depth, geom = excluded.geom, description = excluded.description where (t.depth, t.geom, t.description) is distinct from (excluded.depth, excluded.geom, excluded.description) returning xmax = 0 as inserted) select count(*) filter (where inserted), count(*) filter (where not inserted) from r
+        Query: drop table pg_temp.pgo_upsert
+        {'inserted': 1, 'updated': 1, 'unchanged': 0}
+        """
+        with self.__connection(write=True) as oCon:
+            cursor=oCon.cursor
+
+            it=iter(rows)
+            try:
+                first=next(it)
+            except StopIteration:
+                return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+            self.__invalidateTiles(oCon, table_name)
+            list_field_names=[key for key in first.keys() if list_fields_to_remove is None or key not in list_fields_to_remove]
+            list_conflict_fields=key_fields_list(conflict_fields)
+            if update_fields is None:
+                list_update_fields=[key for key in list_field_names if key not in list_conflict_fields]
+            elif update_fields == '':
+                list_update_fields=[]
+            else:
+                list_update_fields=key_fields_list(update_fields)
+
+            self.__createStaging(oCon, 'pgo_upsert', table_name, list_field_names, geom_field_name)
+            cons='copy pg_temp.pgo_upsert ({0}) from stdin'.format(','.join(list_field_names))
+            n=self.__copyRows(oCon, cons, itertools.chain([first], it), list_field_names,
+                              geom_field_name, epsg, geometry_type)
+            cons=build_upsert(table_name, 'pg_temp.pgo_upsert', list_field_names, list_conflict_fields,
+                              list_update_fields, skip_unchanged, geom_field_name, epsg_to_reproject)
+            self.__execute(oCon, cons)
+            inserted, updated=cursor.fetchone()
+            self.__execute(oCon, 'drop table pg_temp.pgo_upsert')
+            self.__invalidateResults(oCon, table_name)
+            self.__commit(oCon)
+            self.query=cons
+            return {'inserted': inserted, 'updated': updated, 'unchanged': n - inserted - updated}
+
+    def __createStaging(self,oCon, staging_name, table_name, list_field_names, geom_field_name):
+        """
+        Creates the temporary table pg_temp.staging_name, empty, with the fields list_field_names
+        of the table table_name. The geometry field accepts any geometry type and srid
+        """
+        self.__execute(oCon, 'create temp table {0} as select {1} from {2} with no data'.format(staging_name, ','.join(list_field_names), table_name))
+        if geom_field_name in list_field_names:
+            self.__execute(oCon, 'alter table pg_temp.{0} alter column {1} type geometry'.format(staging_name, geom_field_name))
+
+    def __copyRows(self, oCon, cons, iterable_of_dicts, list_field_names, geom_field_name, epsg, geometry_type):
+        """
+        Executes the command cons, 'copy ... from stdin', sending the values of the fields
+        list_field_names of the dictionaries. The geometries are sent in EWKT or hexadecimal EWKB
+        @return: the number of sent rows
+        """
+        counter=[0]
+        encoding=psycopg2.extensions.encodings[oCon.conn.encoding]
+
+        def lines():
+            for d in iterable_of_dicts:
+                counter[0] += 1
+                list_values=[]
+                for key in list_field_names:
+                    value=d.get(key)
+                    if key == geom_field_name and value is not None:
+                        if not isinstance(value, basestring):
+                            value=coords_to_wkb(value, geometry_type, int(epsg))
+                            if value is not None:
+                                value=binascii.hexlify(value)
+                        elif value <> '':
+                            value='SRID={epsg};{wkt}'.format(epsg=epsg, wkt=coords_to_wkt(value, geometry_type))
+                    list_values.append(copy_text_value(value, encoding))
+                yield '\t'.join(list_values) + '\n'
+
+        t0=time.time()
+        oCon.cursor.copy_expert(cons, IteratorFile(lines()))
+        self.__callHooks(cons, None, counter[0], t0)
+        return counter[0]
+
     def pgUpdate(self, table_name, oStrFielsAndValues, cond_where=None, list_values_cond_where=None):
         """
         Updates a table
@@ -194,7 +1405,7 @@ class pgOperations():
         print oStrFielsAndValuesBase.list_field_values
         print oStrFielsAndValuesBase.str_s_values
         
-        oOp=pgo.pgOperations(oPgConnect=oCon)
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
         resp=oOp.pgUpdate(table_name="d.points", 
                           oStrFielsAndValues=oStrFielsAndValuesBase, 
                           cond_where="where gid=%s", 
@@ -230,7 +1441,7 @@ class pgOperations():
         print oStrFielsAndValues.list_field_values
         print oStrFielsAndValues.str_s_values
         
-        oOp=pgo.pgOperations(oPgConnect=oCon)
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
         resp=oOp.pgUpdate(table_name="d.points", 
                           oStrFielsAndValues=oStrFielsAndValues, 
                           cond_where="where gid=%s", 
@@ -245,24 +1456,85 @@ class pgOperations():
         Query: update d.points set (geom,description) = (st_transform(st_geometryfromtext(%s,25830),25831),%s) where gid=%s
         1  
         """
-        conn=self.oPgConnect.conn
-        cursor=self.oPgConnect.cursor
+        with self.__connection(write=True) as oCon:
+            cursor=oCon.cursor
+            cons, values, key=build_update(table_name, oStrFielsAndValues, cond_where, list_values_cond_where)
+            if cond_where <> None:
+                self.__invalidateTiles(oCon, table_name, cond_where, list_values_cond_where, oStrFielsAndValues)
+            else:
+                self.__invalidateTiles(oCon, table_name)
+            self.__execute(oCon, cons, values, key)
+            rowcount=cursor.rowcount
+            self.__invalidateResults(oCon, table_name)
+            self.__commit(oCon)
+            self.query=cons
+            return rowcount
 
-        str_field_names=oStrFielsAndValues.str_field_names
-        list_field_values=oStrFielsAndValues.list_field_values
-        str_s_values=oStrFielsAndValues.str_s_values
-        
-        cons='update {table_name} set ({str_field_names}) = ({str_s_values})'.format(table_name=table_name,str_field_names=str_field_names,str_s_values=str_s_values)
-        if cond_where <> None:
-            cons += ' ' + cond_where
-            print 'Query: ' + cons
-            cursor.execute(cons,list_field_values + list_values_cond_where)
-        else:
-            print 'Query: ' + cons
-            cursor.execute(cons,list_field_values)
-        conn.commit()
-        self.query=cons
-        return cursor.rowcount
+    def pgUpdateMany(self, table_name, key_field, rows, chunk_size=500, list_fields_to_remove=None,
+                     geom_field_name='geom', epsg='25830', geometry_type='POLYGON', epsg_to_reproject=None,
+                     template=None):
+        """
+        Updates many rows of a table, each one with its own values. The rows are sent in
+        chunks of chunk_size rows, each chunk in only one statement
+        'update ... set ... from (values (...),(...),...) as v where t.key = v.key'.
+        Only one commit is done, at the end, when all the chunks have been updated
+
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+            Mandatory specify the schema name: public.tablename
+        @type key_field: string
+        @param key_field: field, or fields comma separated, that identify the row to update.
+            e.g: 'gid'. The key fields are not updated
+        @type rows: iterable
+        @param rows: iterable of dictionaries or StrFielsAndValues objects, with the key
+            fields and the fields to update. All the rows have to have the same field names,
+            in the same order, and the same expressions, as in the method pgInsertMany.
+            The geometries have the same expressions than in the method pgUpdate
+        @type chunk_size: integer
+        @param chunk_size: maximum number of rows to update in each statement
+        @param list_fields_to_remove: see the class StrFielsAndValues. Only used with dictionaries
+        @param geom_field_name: see the class StrFielsAndValues. Only used with dictionaries
+        @param epsg: see the class StrFielsAndValues. Only used with dictionaries
+        @param geometry_type: see the class StrFielsAndValues. Only used with dictionaries
+        @param epsg_to_reproject: see the class StrFielsAndValues. Only used with dictionaries
+        @type template: RowTemplate
+        @param template: template to convert the dictionaries. See the method pgInsertMany
+        @return: a list with the number of updated rows of each chunk
+
+        Example of use:
+
+        import pgOperations as pgo
+        oCon=pgo.pgConnect(database="pruebas", user="postgres", password="postgres", host="localhost", port="5432")
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
+        rows=[{"gid": 1, "depth": 12.15, "geom": "100 200"},
+              {"gid": 2, "depth": 8.5, "geom": "300 300"}]
+        resp=oOp.pgUpdateMany(table_name="d.points", key_field="gid", rows=rows, geom_field_name="geom",
+                              epsg='25830', geometry_type="POINT", epsg_to_reproject="25831")
+        print resp
+
+        The result is:
+        Query: update d.points as t set depth = v.depth::double precision, geom = v.geom::geometry(Point,25831) from (values (%s,%s,st_transform(st_geometryfromtext(%s,25830),25831)),(%s,%s,st_transform(st_geometryfromtext(%s,25830),25831))) as v (gid,depth,geom) where t.gid = v.gid::integer
+        [2]
+        """
+        d=self.getTableMetadata(table_name)
+        if d is None:
+            raise Exception("The table {0} does not exist".format(table_name))
+        list_key_fields=key_fields_list(key_field)
+        with self.__connection(write=True) as oCon:
+            cursor=oCon.cursor
+            self.__invalidateTiles(oCon, table_name)
+
+            list_rowcounts=[]
+            cons=None
+            for oFirst, list_values, n_rows in self.__pages(rows, chunk_size, list_fields_to_remove,
+                                                            geom_field_name, epsg, geometry_type, epsg_to_reproject, template):
+                cons=build_update_many(table_name, oFirst, list_key_fields, d['field_types'], n_rows)
+                self.__execute(oCon, cons, list_values)
+                list_rowcounts.append(cursor.rowcount)
+            self.__invalidateResults(oCon, table_name)
+            self.__commit(oCon)
+            self.query=cons
+            return list_rowcounts
     
     def pgDelete(self, table_name, cond_where=None, list_values_cond_where=None):
         """
@@ -285,29 +1557,84 @@ class pgOperations():
             #deletes all rows
             pg_delete2(table_name='d.buildings') 
         """
-        conn=self.oPgConnect.conn
-        cursor=self.oPgConnect.cursor
-        cons='delete from {table_name}'.format(table_name=table_name)
-        if cond_where <> None:
-            cons += ' ' + cond_where
-            print 'Query: ' + cons
-            cursor.execute(cons, list_values_cond_where)
-        else:
-            print 'Query: ' + cons
-            cursor.execute(cons)
-        conn.commit()
-        self.query=cons
-        return cursor.rowcount
-    
-            
-    def pgSelect(self, table_name, string_fields_to_select, cond_where='', list_val_cond_where=[]):
+        with self.__connection(write=True) as oCon:
+            cursor=oCon.cursor
+            cons, values, key=build_delete(table_name, cond_where, list_values_cond_where)
+            if cond_where <> None:
+                self.__invalidateTiles(oCon, table_name, cond_where, list_values_cond_where)
+            else:
+                self.__invalidateTiles(oCon, table_name)
+            self.__execute(oCon, cons, values, key)
+            rowcount=cursor.rowcount
+            self.__invalidateResults(oCon, table_name)
+            self.__commit(oCon)
+            self.query=cons
+            return rowcount
+
+    def pgDeleteMany(self, table_name, key_field, keys, chunk_size=1000, str_fields_returning=None):
         """
-        Select rows of a table
-        
+        Deletes the rows of a table with the key values of a list. The keys are sent in
+        chunks of chunk_size keys, each chunk as only one array parameter:
+        'delete from ... where key = any(%s)'. Each chunk is commited as a pgDelete call,
+        so the locks of a big delete are released chunk by chunk
+
         @type  table_name: string
-        @param table_name: table name included the schema. Ej. "d.linde". 
+        @param table_name: table name included the schema. Ej. "d.linde".
             Mandatory specify the schema name: public.tablename
-        @type string_fields_to_select: string
+        @type key_field: string
+        @param key_field: name of the field with the key values. e.g: 'gid'
+        @type keys: iterable
+        @param keys: list or generator of the key values of the rows to delete. e.g: [1, 2, 3]
+        @type chunk_size: integer
+        @param chunk_size: maximum number of keys in each statement
+        @param str_fields_returning: string with the field names, of the deleted rows, to return.
+            ej: "gid, description"
+        @type str_fields_returning: string
+        @return:
+            if str_fields_returning is None, the number of deleted rows
+            if str_fields_returning is 'gid, description' returns a list with a tuple with
+                the gid and description of each deleted row
+
+        Example of use:
+            oOp.pgDeleteMany(table_name='d.points', key_field='gid', keys=[1, 2, 3])
+
+        Query: delete from d.points where gid = any(%s)
+        3
+        """
+        cons='delete from {0} where {1} = any(%s)'.format(table_name, key_field)
+        if str_fields_returning <> None:
+            cons += ' returning ' + str_fields_returning
+        n=0
+        returning=[]
+        it=iter(keys)
+        while True:
+            chunk=list(itertools.islice(it, chunk_size))
+            if not chunk:
+                break
+            with self.__connection(write=True) as oCon:
+                cursor=oCon.cursor
+                self.__invalidateTiles(oCon, table_name)
+                self.__execute(oCon, cons, [chunk], ('delete_many', table_name, key_field, str_fields_returning))
+                if str_fields_returning <> None:
+                    returning.extend(cursor.fetchall())
+                n += cursor.rowcount
+                self.__invalidateResults(oCon, table_name)
+                self.__commit(oCon)
+        self.query=cons
+        if str_fields_returning <> None:
+            return returning
+        return n
+    
+            
+    def pgSelect(self, table_name, string_fields_to_select, cond_where='', list_val_cond_where=[], limit=100, row_format='json',
+                 simplify_tolerance=None, max_decimal_digits=None, zoom=None, geom_field_name='geom'):
+        """
+        Select rows of a table
+        
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde". 
+            Mandatory specify the schema name: public.tablename
+        @type string_fields_to_select: string
         @param string_fields_to_select: string with the fields to select, comma separated. e.g: 'gid, descripcion, area, st_asgeojson(geom)'
         @type cond_where: string
         @param cond_where: the where condition to find the affected rows without values. 
@@ -315,17 +1642,40 @@ class pgOperations():
         @type list_values_cond_where: list
         @param list_values_cond_where: list of the values of the %s in the 
             parameter cond_where. e.g: [250, 'Alicante']        
+        @type limit: integer
+        @param limit: maximum number of rows to select. None to select all the rows.
+            To select a big number of rows use the method pgSelectIter
+        @type row_format: string
+        @param row_format: how the rows are obtained and returned:
+            * 'json': the server converts the rows to json, with array_to_json, and they
+              are decoded to a list of dictionaries. Default value
+            * 'dict': the rows are read with the psycopg2 type adaptation and returned
+              as dictionaries. Numeric, dates, ... are not converted to json types
+            * 'tuple': the rows are returned as tuples. The field names, in the same order,
+              are stored in the property field_names. Each thread has its own field_names
+            * 'namedtuple': the rows are returned as named tuples
+        @type simplify_tolerance: float
+        @param simplify_tolerance: simplification tolerance of the geometries. See the method getTableFieldNames.
+            The options simplify_tolerance, max_decimal_digits and zoom change the expression
+            st_asgeojson(geom_field_name) of string_fields_to_select
+        @type max_decimal_digits: integer
+        @param max_decimal_digits: maximum number of decimal digits of the coordinates. See the method getTableFieldNames
+        @type zoom: integer
+        @param zoom: zoom level of the web map. See the method getTableFieldNames
+        @type geom_field_name: string
+        @param geom_field_name: the geometry field name
         @return: 
             * None if there is not any selected row
             * a list of dictionaries fieldName:fieldValue. Each dictionary is a selected row
               to get the fist dictionary: lista[0]
               to get the second dictionary: lista[1]
               ... and so on
+              With row_format 'tuple' or 'namedtuple' is a list of tuples or named tuples
         
         Example of use:
         import pgOperations2 as pgo
         oCon=pgo.pgConnect(database="pruebas", user="postgres", password="postgres", host="localhost", port="5432")  
-        oOp=pgo.pgOperations(oPgConnect=oCon)
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
         resp=oOp.pgSelect(table_name="d.points", 
                           string_fields_to_select='gid,depth,description,st_astext(geom)', 
                           cond_where = 'where gid > %s', 
@@ -335,36 +1685,566 @@ class pgOperations():
         Result
         
         Connected
-        SELECT array_to_json(array_agg(registros)) FROM (select gid,depth,description,st_astext(geom) from d.points as t where gid > %s limit 100) as registros;
+        Query: SELECT array_to_json(array_agg(registros)) FROM (select gid,depth,description,st_astext(geom) from d.points as t where gid > %s limit 100) as registros;
         [{u'depth': None, u'gid': 2, u'st_astext': u'POINT(-673652.157623927 202.793645345479)', u'description': u'water well'}, 
          {u'depth': 12.15, u'gid': 1, u'st_astext': u'POINT(-673449.363930927 304.189446432685)', u'description': u'water well2'}
         ]
         """
-        cursor=self.oPgConnect.cursor
-        
+        expression=self.__geojsonExpression(table_name, geom_field_name, simplify_tolerance, max_decimal_digits, zoom)
+        if expression is not None:
+            string_fields_to_select=re.sub(r'(?i)st_asgeojson\(\s*{0}\s*\)'.format(re.escape(geom_field_name)),
+                                           lambda m: expression, string_fields_to_select)
         #forms the select string
-        cons='SELECT array_to_json(array_agg(registros)) FROM (select {string_fields_to_select} from {table_name} as t {cond_where} limit 100) as registros;'.format(string_fields_to_select=string_fields_to_select,table_name=table_name,cond_where=cond_where)      
-        print cons
+        cons, values=build_select(table_name, string_fields_to_select, cond_where, list_val_cond_where, limit, row_format)
         self.query=cons
-        #executes the string. The list_val_cond_where has the values of the %s in the select string by order
-        if cond_where == '':
-            cursor.execute(cons)
+        #the results read with a reserved connection can have writes not commited
+        use_cache=self.result_cache is not None and not self.__reserved()
+        if use_cache:
+            #the values are pickled because they can be lists, which are not hashable
+            key=(cons, cPickle.dumps(values, cPickle.HIGHEST_PROTOCOL))
+            r=self.result_cache.get(key)
+            if r is not None:
+                lista, field_names=r
+                if row_format <> 'json':
+                    self.local.field_names=field_names
+                return decode_select(lista, field_names, row_format)
+        def select(oCon):
+            cursor=oCon.cursor
+            #executes the string. The list_val_cond_where has the values of the %s in the select string by order
+            self.__execute(oCon, cons, values)
+            #gets all rows 
+            lista = cursor.fetchall()
+            field_names=None
+            if row_format <> 'json':
+                field_names=[d[0] for d in cursor.description]
+            return lista, field_names
+        lista, field_names=self.__read(select)
+        if row_format <> 'json':
+            self.local.field_names=field_names
+        if use_cache:
+            self.result_cache.put(key, table_name, (lista, field_names))
+        return decode_select(lista, field_names, row_format)
+
+
+    def pgSelectIter(self, table_name, string_fields_to_select, cond_where='', list_val_cond_where=[],
+                     limit=None, itersize=2000, chunk_size=None, row_format='dict'):
+        """
+        Select rows of a table, as the method pgSelect, but returns a generator. The rows are
+        read with a server side cursor, in groups of itersize rows, so the memory used
+        does not depend on the number of selected rows
+
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+            Mandatory specify the schema name: public.tablename
+        @type string_fields_to_select: string
+        @param string_fields_to_select: string with the fields to select, comma separated. e.g: 'gid, descripcion, area, st_asgeojson(geom)'
+        @type cond_where: string
+        @param cond_where: the where condition to find the affected rows without values.
+            Instead of the values you have to put %s. e.g 'where area > %s and province = %s'
+        @type list_values_cond_where: list
+        @param list_values_cond_where: list of the values of the %s in the
+            parameter cond_where. e.g: [250, 'Alicante']
+        @type limit: integer
+        @param limit: maximum number of rows to select. None to select all the rows
+        @type itersize: integer
+        @param itersize: number of rows read from the server each time
+        @type chunk_size: integer
+        @param chunk_size: None to get the rows one by one. If it is a number, the rows
+            are returned in lists of chunk_size rows, the last list can be shorter
+        @type row_format: string
+        @param row_format: 'dict', 'tuple' or 'namedtuple'. See the method pgSelect
+        @return: a generator of dictionaries fieldName:fieldValue, or of lists of
+            dictionaries if chunk_size is not None
+
+        Example of use:
+        import pgOperations as pgo
+        oCon=pgo.pgConnect(database="pruebas", user="postgres", password="postgres", host="localhost", port="5432")
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
+        for row in oOp.pgSelectIter(table_name="d.points",
+                                    string_fields_to_select='gid,depth,description,st_astext(geom)',
+                                    cond_where = 'where gid > %s',
+                                    list_val_cond_where=[0]):
+            print row
+
+        Result
+
+        Query: select gid,depth,description,st_astext(geom) from d.points as t where gid > %s
+        {u'depth': None, u'gid': 2, u'st_astext': u'POINT(-673652.157623927 202.793645345479)', u'description': u'water well'}
+        {u'depth': 12.15, u'gid': 1, u'st_astext': u'POINT(-673449.363930927 304.189446432685)', u'description': u'water well2'}
+        """
+        with self.__connection() as oCon:
+            conn=oCon.conn
+
+            cons='select {string_fields_to_select} from {table_name} as t {cond_where}'.format(string_fields_to_select=string_fields_to_select,table_name=table_name,cond_where=cond_where)
+            if limit is not None:
+                cons += ' limit {0}'.format(int(limit))
+            self.query=cons
+            cursor=conn.cursor('pgo_select_iter_{0}'.format(next(self.named_cursor_counter)))
+            cursor.itersize=itersize
+            try:
+                if cond_where == '':
+                    self.__execute(oCon, cons, cursor=cursor)
+                else:
+                    self.__execute(oCon, cons, list_val_cond_where, cursor=cursor)
+                decode=None
+                chunk=[]
+                for row in cursor:
+                    if decode is None:
+                        decode=row_decoder([d[0] for d in cursor.description], row_format)
+                    row=decode(row)
+                    if chunk_size is None:
+                        yield row
+                    else:
+                        chunk.append(row)
+                        if len(chunk) == chunk_size:
+                            yield chunk
+                            chunk=[]
+                if chunk:
+                    yield chunk
+            finally:
+                cursor.close()
+
+    def pgSelectPage(self, table_name, string_fields_to_select, key_field='gid', page_size=100,
+                     cond_where='', list_val_cond_where=[], descending=False, cursor_token=None,
+                     row_format='dict'):
+        """
+        Selects a page of rows of a table with keyset pagination: the rows are ordered by
+        key_field, and the next page is selected with 'where key > last key', so
+        each page costs the same, as deep in the table as it is, unlike with offset
+
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+        @type string_fields_to_select: string
+        @param string_fields_to_select: string with the fields to select, comma separated
+        @type key_field: string or list
+        @param key_field: field, or fields comma separated or in a list, that identify
+            each row, in the order of the pages. e.g: 'gid' or 'province, gid'.
+            The values must be unique, and it should exist an index on them
+        @type page_size: integer
+        @param page_size: maximum number of rows of the page
+        @type cond_where: string
+        @param cond_where: the where condition, as in pgSelect. e.g 'where area > %s'.
+            Can not have order by or limit
+        @type list_values_cond_where: list
+        @param list_values_cond_where: list of the values of the %s in the parameter cond_where
+        @type descending: boolean
+        @param descending: if True, the rows are ordered from the greatest to the smallest key
+        @type cursor_token: string
+        @param cursor_token: None to get the first page. The token returned with the
+            previous page to get the next one
+        @type row_format: string
+        @param row_format: 'dict', 'tuple' or 'namedtuple'. See the method pgSelect
+        @return: a tuple (list of rows, token of the next page). The token is None
+            if this is the last page. It is a string that can be sent to a client
+            and used later, in other connection or process, to get the next page
+
+        Example of use:
+        rows, token=oOp.pgSelectPage(table_name="d.points", string_fields_to_select='gid,depth,description',
+                                      page_size=2)
+        rows, token=oOp.pgSelectPage(table_name="d.points", string_fields_to_select='gid,depth,description',
+                                      page_size=2, cursor_token=token)
+        """
+        list_key_fields=key_fields_list(key_field)
+        last_key=decode_page_token(cursor_token, list_key_fields)
+        cons, values=build_select_page(table_name, string_fields_to_select, list_key_fields, page_size,
+                                       cond_where, list_val_cond_where, descending, last_key)
+        def select(oCon):
+            self.__execute(oCon, cons, values)
+            return oCon.cursor.fetchall(), [d[0] for d in oCon.cursor.description]
+        self.query=cons
+        lista, field_names=self.__read(select)
+        n=len(list_key_fields)
+        decode=row_decoder(field_names[n:], row_format)
+        rows=[decode(row[n:]) for row in lista]
+        if len(lista) < page_size:
+            return rows, None
+        return rows, encode_page_token(list_key_fields, lista[-1][:n])
+
+    def pgSelectPages(self, table_name, string_fields_to_select, key_field='gid', page_size=100,
+                      cond_where='', list_val_cond_where=[], descending=False, cursor_token=None,
+                      row_format='dict'):
+        """
+        Selects all the rows of a table, page by page, with keyset pagination.
+        See the method pgSelectPage for the parameters
+        @return: a generator of tuples (list of rows, token of the next page). The
+            pages are selected when they are requested. The empty pages are not returned
+
+        Example of use:
+        for rows, token in oOp.pgSelectPages(table_name="d.points", string_fields_to_select='gid,depth',
+                                             key_field='gid', page_size=1000, descending=True):
+            print len(rows), token
+        """
+        while True:
+            rows, cursor_token=self.pgSelectPage(table_name, string_fields_to_select, key_field, page_size,
+                                                 cond_where, list_val_cond_where, descending, cursor_token,
+                                                 row_format)
+            if rows:
+                yield rows, cursor_token
+            if cursor_token is None:
+                return
+
+    def pgParallelExport(self, table_name, string_fields_to_select, key_field=None, n_workers=4, sink=None,
+                         cond_where='', list_val_cond_where=[], n_ranges=None, chunk_size=1000,
+                         consistent=True):
+        """
+        Exports all the rows of a table using n_workers threads, each one with its own
+        connection. The table is split in ranges of key_field values, or in ranges of
+        blocks, by ctid, if key_field is None. Each worker selects its ranges with a server
+        side cursor, and sends the rows to the sink, so the memory used does not depend on
+        the number of rows. psycopg2 releases the GIL while it waits for the server, so the
+        reading and the transfer of the rows are done in parallel
+
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+            Mandatory specify the schema name: public.tablename
+        @type string_fields_to_select: string
+        @param string_fields_to_select: string with the fields to select, comma separated
+        @type key_field: string
+        @param key_field: integer field, with an index, to split the table. e.g: 'gid'.
+            None to split the table by blocks. With PostgreSQL older than 14 each range
+            of blocks reads the whole table, so a key field is much faster
+        @type n_workers: integer
+        @param n_workers: number of threads and connections
+        @param sink: where the rows are sent. The rows are tuples. It can be:
+            * a function, called with a list of at most chunk_size rows. The calls are
+              serialized, so the function does not have to be thread safe
+            * a file, or other object with the method write. The rows are written in the
+              text format of the command 'copy', a line for each row
+            * a Queue.Queue. Lists of at most chunk_size rows are put in the queue, and None
+              when the export finishes
+        @type cond_where: string
+        @param cond_where: the where condition, as in pgSelect. e.g 'where area > %s'
+        @type list_values_cond_where: list
+        @param list_values_cond_where: list of the values of the %s in the parameter cond_where
+        @type n_ranges: integer
+        @param n_ranges: number of ranges. The workers take the next range when they finish
+            one, so with more ranges than workers the work is better balanced.
+            None to use 4 ranges by worker
+        @type chunk_size: integer
+        @param chunk_size: number of rows read from the server each time, and sent to the sink
+        @type consistent: boolean
+        @param consistent: if True, all the workers read the same snapshot of the database,
+            exported with pg_export_snapshot, so the rows modified during the export are
+            exported as they were at the begining
+        @return: the number of exported rows
+
+        Example of use:
+        import pgOperations as pgo
+        oPool=pgo.pgConnectPool(minconn=1, maxconn=10, database="pruebas", user="postgres",
+                                password="postgres", host="localhost", port="5432")
+        oOp=pgo.pgOperations(oPgConnect=oPool)
+        with open('/tmp/points.txt', 'wb') as f:
+            n=oOp.pgParallelExport(table_name="d.points", string_fields_to_select='gid,depth,st_astext(geom)',
+                                   key_field='gid', n_workers=8, sink=f)
+        print n
+        """
+        if n_ranges is None:
+            n_ranges=4*n_workers
+        send=export_sink(sink)
+        conn=psycopg2.connect(**self.oPgConnect.params)
+        try:
+            cursor=conn.cursor()
+            snapshot=None
+            if consistent:
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+                cursor.execute('select pg_export_snapshot()')
+                snapshot=cursor.fetchone()[0]
+            if key_field is not None:
+                cons='select min({0}), max({0}) from {1}'.format(key_field, table_name)
+                t0=time.time()
+                cursor.execute(cons)
+                self.__callHooks(cons, None, cursor.rowcount, t0)
+                list_ranges=key_ranges(cursor.fetchone(), n_ranges)
+                str_lower='{0} >= %s'.format(key_field)
+                str_upper=' and {0} < %s'.format(key_field)
+            else:
+                cons="select pg_relation_size(%s) / current_setting('block_size')::integer"
+                t0=time.time()
+                cursor.execute(cons, [table_name])
+                self.__callHooks(cons, [table_name], cursor.rowcount, t0)
+                n_blocks=cursor.fetchone()[0]
+                list_ranges=[('({0},0)'.format(lower), None if upper is None else '({0},0)'.format(upper))
+                             for lower, upper in key_ranges((0, max(n_blocks - 1, 0)), n_ranges)]
+                str_lower='ctid >= %s::tid'
+                str_upper=' and ctid < %s::tid'
+            cond=re.sub(r'(?i)^\s*where\s+', '', cond_where).strip()
+            if cond <> '':
+                cond='(' + cond + ') and '
+            else:
+                list_val_cond_where=[]
+            cons='select {0} from {1} as t where {2}{3}'.format(string_fields_to_select, table_name, cond, str_lower)
+
+            ranges=Queue.Queue()
+            for r in list_ranges:
+                ranges.put(r)
+            counter=[0]
+            errors=[]
+            lock=threading.Lock()
+
+            def worker():
+                try:
+                    wconn=psycopg2.connect(**self.oPgConnect.params)
+                except Exception as e:
+                    errors.append(e)
+                    return
+                try:
+                    if snapshot is not None:
+                        wconn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+                        wconn.cursor().execute('set transaction snapshot %s', [snapshot])
+                    while not errors:
+                        try:
+                            lower, upper=ranges.get_nowait()
+                        except Queue.Empty:
+                            break
+                        #the last range has not upper limit, for the rows added after reading the limits
+                        if upper is None:
+                            cons_range=cons
+                            values=list_val_cond_where + [lower]
+                        else:
+                            cons_range=cons + str_upper
+                            values=list_val_cond_where + [lower, upper]
+                        wcursor=wconn.cursor('pgo_export_{0}'.format(next(self.named_cursor_counter)))
+                        try:
+                            t0=time.time()
+                            wcursor.execute(cons_range, values)
+                            n=0
+                            while not errors:
+                                rows=wcursor.fetchmany(chunk_size)
+                                if not rows:
+                                    break
+                                n += len(rows)
+                                send(rows)
+                            self.__callHooks(cons_range, values, n, t0)
+                            with lock:
+                                counter[0] += n
+                        finally:
+                            wcursor.close()
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    wconn.close()
+
+            threads=[threading.Thread(target=worker) for i in xrange(min(n_workers, len(list_ranges)))]
+            try:
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            finally:
+                send(None)
+            self.query=cons
+            if errors:
+                raise errors[0]
+            return counter[0]
+        finally:
+            conn.close()
+
+    def exportGeoJSON(self, table_name, fileobj, string_fields=None, geom_field_name='geom', cond_where='',
+                      list_val_cond_where=[], ndjson=False, limit=None, itersize=2000):
+        """
+        Writes the rows of a table as GeoJSON features in a file, without storing them in memory.
+        The server builds each feature, with json_build_object, and the features are read with
+        a server side cursor, in groups of itersize rows, and written as they are read
+
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+            Mandatory specify the schema name: public.tablename
+        @type fileobj: file
+        @param fileobj: file, or other object with the method write, where the features
+            are written, encoded in utf-8
+        @type string_fields: string
+        @param string_fields: field names, comma separated, of the properties of the features.
+            e.g: 'gid, description'. None to use all the fields except the geometries.
+            The function json_build_object admits at most 50 properties
+        @type geom_field_name: string
+        @param geom_field_name: name of the geometry field in the table
+        @type cond_where: string
+        @param cond_where: the where condition, as in pgSelect. e.g 'where area > %s'
+        @type list_values_cond_where: list
+        @param list_values_cond_where: list of the values of the %s in the parameter cond_where
+        @type ndjson: boolean
+        @param ndjson: if False, writes a FeatureCollection. If True, writes a feature in
+            each line (newline delimited json)
+        @type limit: integer
+        @param limit: maximum number of features. None to export all the rows
+        @type itersize: integer
+        @param itersize: number of features read from the server each time
+        @return: the number of written features
+
+        Example of use:
+        import pgOperations as pgo
+        oCon=pgo.pgConnect(database="pruebas", user="postgres", password="postgres", host="localhost", port="5432")
+        oOp=pgo.pgOperations(oPgConnect=oCon, verbose=True)
+        with open('/tmp/points.geojson', 'wb') as f:
+            print oOp.exportGeoJSON(table_name="d.points", fileobj=f, string_fields='gid,description')
+
+        The result is:
+        Query: select json_build_object('type', 'Feature', 'geometry', st_asgeojson(geom)::json, 'properties', json_build_object('gid', gid, 'description', description))::text from d.points as t
+        2
+        """
+        list_field_names=self.getTableFieldNames(table_name, True, geom_field_name)
+        if list_field_names is None:
+            raise Exception("The table {0} does not exist".format(table_name))
+        str_geometry='st_asgeojson({0})'.format(geom_field_name)
+        if str_geometry not in list_field_names:
+            raise Exception("The table {0} has not the field {1}".format(table_name, geom_field_name))
+        if string_fields is None:
+            geometry_fields=self.getTableMetadata(table_name)['geometry_fields']
+            list_properties=[field for field in list_field_names if field <> str_geometry and field not in geometry_fields]
         else:
-            cursor.execute(cons, list_val_cond_where)
-        #gets all rows 
-        lista = cursor.fetchall()
-        r=lista[0][0]
-        if r == None:
-            return None #there wheren't selected rows
+            list_properties=key_fields_list(string_fields)
+        str_properties=', '.join(["'{0}', {0}".format(field) for field in list_properties])
+        str_feature="json_build_object('type', 'Feature', 'geometry', {0}::json, 'properties', json_build_object({1}))::text".format(str_geometry, str_properties)
+        if ndjson:
+            header, separator, footer='', '\n', '\n'
         else:
-            #in ubuntu 14.04 r is a string, in 16.04 is a list
-            #so if is string i convert it in list to return alwais a list
-            if type(r) is str:
-                r=json.loads(r)
-            return r
+            header, separator, footer='{"type": "FeatureCollection", "features": [\n', ',\n', '\n]}\n'
+        n=0
+        fileobj.write(header)
+        for chunk in self.pgSelectIter(table_name, str_feature, cond_where, list_val_cond_where, limit=limit,
+                                       itersize=itersize, chunk_size=itersize, row_format='tuple'):
+            s=separator.join([row[0] for row in chunk])
+            if isinstance(s, unicode):
+                s=s.encode('utf-8')
+            if n > 0:
+                fileobj.write(separator)
+            fileobj.write(s)
+            n += len(chunk)
+        if n > 0 or not ndjson:
+            fileobj.write(footer)
+        return n
 
+    def __geometrySrid(self, table_name, geom_field_name):
+        """
+        Returns the srid of a geometry field, from the table metadata. Raises an exception if
+        the field is not registered in the view geometry_columns, or its srid is 0
+        """
+        d=self.getTableMetadata(table_name)
+        if d is None:
+            raise Exception("The table {0} does not exist".format(table_name))
+        srid=d['geometry_fields'].get(geom_field_name, {}).get('srid')
+        if not srid:
+            raise Exception("The field {0} of the table {1} has not a srid".format(geom_field_name, table_name))
+        return srid
+
+    def pgSelectBBox(self, table_name, string_fields_to_select, xmin, ymin, xmax, ymax, srid=None,
+                     geom_field_name='geom', cond_where='', list_val_cond_where=[], limit=100, row_format='json'):
+        """
+        Selects the rows of a table whose geometry bounding box intersects a rectangle, as in a
+        map viewport. The condition is 'geom && st_makeenvelope(...)', with the rectangle
+        transformed to the srid of the field, so the spatial index of the field is used
+
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+        @type string_fields_to_select: string
+        @param string_fields_to_select: string with the fields to select, comma separated. e.g: 'gid, st_asgeojson(geom)'
+        @param xmin: minimum x of the rectangle
+        @param ymin: minimum y of the rectangle
+        @param xmax: maximum x of the rectangle
+        @param ymax: maximum y of the rectangle
+        @type srid: integer
+        @param srid: srid of the rectangle coordinates. None if it is the srid of the geometry field
+        @type geom_field_name: string
+        @param geom_field_name: name of the geometry field in the table
+        @type cond_where: string
+        @param cond_where: other condition, as in pgSelect. e.g 'where area > %s'
+        @type list_values_cond_where: list
+        @param list_values_cond_where: list of the values of the %s in the parameter cond_where
+        @param limit: see the method pgSelect
+        @param row_format: see the method pgSelect
+        @return: the selected rows, as in the method pgSelect
+
+        Example of use:
+            resp=oOp.pgSelectBBox(table_name="d.points", string_fields_to_select='gid,st_astext(geom)',
+                                  xmin=-0.4, ymin=39.4, xmax=-0.3, ymax=39.5, srid=4326)
+
+        Query: SELECT array_to_json(array_agg(registros)) FROM (select gid,st_astext(geom) from d.points as t where t.geom && st_transform(st_makeenvelope(%s,%s,%s,%s,4326),25831) limit 100) as registros;
+        """
+        table_srid=self.__geometrySrid(table_name, geom_field_name)
+        if srid is None or int(srid) == table_srid:
+            str_envelope='st_makeenvelope(%s,%s,%s,%s,{0})'.format(table_srid)
+        else:
+            str_envelope='st_transform(st_makeenvelope(%s,%s,%s,%s,{0}),{1})'.format(int(srid), table_srid)
+        cond='where t.{0} && {1}'.format(geom_field_name, str_envelope)
+        values=[xmin, ymin, xmax, ymax]
+        cond_where=re.sub(r'(?i)^\s*where\s+', '', cond_where).strip()
+        if cond_where <> '':
+            cond += ' and (' + cond_where + ')'
+            values.extend(list_val_cond_where)
+        return self.pgSelect(table_name, string_fields_to_select, cond, values, limit, row_format)
+
+    def pgTile(self, table_name, z, x, y, string_fields=None, geom_field_name='geom', cond_where='',
+               list_val_cond_where=[], layer_name=None, extent=4096, buffer=64):
+        """
+        Returns a Mapbox Vector Tile, made with st_asmvt, with the rows of a table in the tile
+        z/x/y of the XYZ scheme (EPSG:3857), as the web maps request them. If the object has a
+        tile cache, the tiles are stored in it, and read from it the next times
+
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+        @type z: integer
+        @param z: zoom level
+        @type x: integer
+        @param x: column of the tile
+        @type y: integer
+        @param y: row of the tile, from the north
+        @type string_fields: string
+        @param string_fields: field names, comma separated, of the feature attributes.
+            None to use all the fields except the geometries
+        @type geom_field_name: string
+        @param geom_field_name: name of the geometry field in the table
+        @type cond_where: string
+        @param cond_where: other condition, as in pgSelect. e.g 'where area > %s'
+        @type list_values_cond_where: list
+        @param list_values_cond_where: list of the values of the %s in the parameter cond_where
+        @type layer_name: string
+        @param layer_name: name of the layer in the tile. None to use the table name
+        @type extent: integer
+        @param extent: size of the tile in tile coordinates
+        @type buffer: integer
+        @param buffer: size of the margin, in tile coordinates, of the geometries clipped by the tile
+        @return: the tile, a string of bytes. It is an empty string if there are not rows in the tile
+
+        Example of use:
+            tile=oOp.pgTile('d.points', 15, 16383, 12534)
 
-    def getTableFieldNames(self, nomTable, changeGeomBySt_asgeojosonGeom=True, nomGeometryField='geom'):
+        Query: select st_asmvt(q, %s, %s, 'geom') from (select gid, description, depth, st_asmvtgeom(st_transform(t.geom,3857), st_makeenvelope(%s,%s,%s,%s,3857), %s, %s, true) as geom from d.points as t where t.geom && st_transform(st_makeenvelope(%s,%s,%s,%s,3857),25831)) as q
+        """
+        if layer_name is None:
+            layer_name=table_name
+        margin=buffer/float(extent)
+        #the values are pickled because they can be lists, which are not hashable
+        key=(table_name, geom_field_name, z, x, y, margin,
+             (string_fields, cond_where, cPickle.dumps(list_val_cond_where, cPickle.HIGHEST_PROTOCOL), layer_name, extent))
+        #the tiles made with a reserved connection can have writes not commited
+        use_cache=self.tile_cache is not None and not self.__reserved()
+        if use_cache:
+            tile=self.tile_cache.get(key)
+            if tile is not None:
+                return tile
+        table_srid=self.__geometrySrid(table_name, geom_field_name)
+        if string_fields is None:
+            d=self.getTableMetadata(table_name)
+            list_properties=[field for field in d['field_names'] if field not in d['geometry_fields']]
+        else:
+            list_properties=key_fields_list(string_fields)
+        cond_where=re.sub(r'(?i)^\s*where\s+', '', cond_where).strip()
+        cons, values=build_tile(table_name, geom_field_name, table_srid, list_properties, cond_where,
+                                tile_envelope(z, x, y), tile_envelope(z, x, y, margin), layer_name, extent, buffer)
+        if cond_where <> '':
+            values.extend(list_val_cond_where)
+        def select(oCon):
+            self.__execute(oCon, cons, values)
+            return oCon.cursor.fetchone()[0]
+        self.query=cons
+        tile=self.__read(select)
+        tile='' if tile is None else str(tile)
+        if use_cache:
+            self.tile_cache.put(key, tile)
+        return tile
+
+    def getTableFieldNames(self, nomTable, changeGeomBySt_asgeojosonGeom=True, nomGeometryField='geom',
+                           simplify_tolerance=None, max_decimal_digits=None, zoom=None):
         """
         Retuns a list with the table field names.
         @type  nomTable: string
@@ -374,39 +2254,111 @@ class pgOperations():
         @param changeGeomBySt_asgeojosonGeom: Specifies id the geom name field is changed by st_asgeojson(fieldName).     
         @type  nomGeometryField: string
         @param nomGeometryField: the geometry field name
+        @type simplify_tolerance: float
+        @param simplify_tolerance: if it is not None, the geometry is simplified with
+            st_simplifypreservetopology, with this tolerance in the units of the geometry
+        @type max_decimal_digits: integer
+        @param max_decimal_digits: if it is not None, maximum number of decimal digits
+            of the coordinates in the GeoJSON
+        @type zoom: integer
+        @param zoom: zoom level of the web map where the geometries are shown. If it is
+            not None, the simplify_tolerance and max_decimal_digits that are None are
+            computed from it: the tolerance is the size of a pixel
         @return: A list with the table fiedl names
     
-        Executes the sentence: 
-        SELECT column_name FROM information_schema.columns WHERE table_schema='h30' and table_name = 'linde';
+        The field names are taken from the metadata cache. See the method getTableMetadata
         
         Examples of use:
             listaCampos=getTableFieldNames('d.buildings')
                 Returns: [u'gid', u'descripcion', u'area', 'st_asgeojson(geom)', u'fecha']
             listaCampos=getTableFieldNames(d.buildings', changeGeomBySt_asgeojosonGeom=False, nomGeometryField='geom')
                 Returns: [u'gid', u'descripcion', u'area', u'geom', u'fecha']
+            listaCampos=getTableFieldNames('d.buildings', zoom=12)
+                Returns: [u'gid', u'descripcion', u'area', 'st_asgeojson(st_simplifypreservetopology(geom,38.21851414258813),0)', u'fecha']
         """
-        
-        consulta="SELECT column_name FROM information_schema.columns WHERE table_schema=%s and table_name = %s";
-        
-        lis=nomTable.split(".")
-        
-        cursor=self.oPgConnect.cursor
-        cursor.execute(consulta,lis)
-        if cursor.rowcount==0:
+        d=self.getTableMetadata(nomTable)
+        expression=self.__geojsonExpression(nomTable, nomGeometryField, simplify_tolerance, max_decimal_digits, zoom)
+        return field_names_list(d, changeGeomBySt_asgeojosonGeom, nomGeometryField, expression)
+
+    def __geojsonExpression(self, table_name, geom_field_name, simplify_tolerance=None, max_decimal_digits=None, zoom=None):
+        """
+        Returns the GeoJSON expression of the geometry field with the simplification and precision
+        options. See the method getTableFieldNames. None if all the options are None
+        """
+        if zoom is not None:
+            d=self.getTableMetadata(table_name)
+            geographic=False
+            if d is not None:
+                geographic=d['geometry_fields'].get(geom_field_name, {}).get('geographic', False)
+            if simplify_tolerance is None:
+                simplify_tolerance=zoom_tolerance(zoom, geographic)
+            if max_decimal_digits is None:
+                max_decimal_digits=zoom_decimal_digits(zoom, geographic)
+        if simplify_tolerance is None and max_decimal_digits is None:
             return None
-            
-        listaValores=cursor.fetchall()#es una lista de tuplas.
-                #cada tupla es una fila. En este caso, la fila tiene un
-                #unico elemento, que es el nombre del campo.
-        listaNombreCampos=[]
-        for fila2 in listaValores:
-            valor=fila2[0]
-            if changeGeomBySt_asgeojosonGeom:
-                if valor==nomGeometryField:
-                    valor='st_asgeojson({0})'.format(nomGeometryField)
-            listaNombreCampos.append(valor)
+        return geojson_expression(geom_field_name, simplify_tolerance, max_decimal_digits)
+
+    def getTableMetadata(self, table_name):
+        """
+        Returns the metadata of a table. The metadata is read from the pg_catalog tables,
+        and stored in a cache during metadata_ttl seconds
+        @type  table_name: string
+        @param table_name: table name included the schema. Ej. "d.linde".
+            Mandatory specify the schema name: public.tablename
+        @return: None if the table does not exist, or a dictionary with the keys:
+            field_names: list of the field names, in the table order
+            field_types: dictionary fieldName:type. e.g: {'gid': 'integer', 'geom': 'geometry(Point,25831)'}
+            primary_key: list of the field names of the primary key
+            geometry_fields: dictionary fieldName:{'srid': srid, 'type': type, 'geographic': boolean}, with the
+                geometry fields registered in the view geometry_columns. geographic is True if
+                the coordinates are longitudes and latitudes. Empty if the database has not PostGIS
+
+        Example of use:
+            print oOp.getTableMetadata('d.points')
+            {'field_names': [u'gid', u'description', u'depth', u'geom'],
+             'field_types': {u'gid': u'integer', u'description': u'character varying', u'depth': u'double precision', u'geom': u'geometry(Point,25831)'},
+             'primary_key': [u'gid'],
+             'geometry_fields': {u'geom': {'srid': 25831, 'type': u'POINT', 'geographic': False}}}
+        """
+        d=self.metadata.get(table_name)
+        if d is None or (self.metadata_ttl is not None and time.time() - d['time'] > self.metadata_ttl):
+            self.prefetchMetadata(list_tables=[table_name])
+            d=self.metadata.get(table_name)
+        if d is None or d['field_names'] is None:
+            return None
+        return d
+
+    def prefetchMetadata(self, schema=None, list_tables=None):
+        """
+        Reads, with only one query, the metadata of all the tables of a schema, or of a
+        list of tables, and stores it in the cache. See the method getTableMetadata
+        @type schema: string
+        @param schema: schema name. e.g "d"
+        @type list_tables: list
+        @param list_tables: list of table names included the schema. e.g: ["d.points", "d.buildings"]
+        @return: the number of tables read
+        """
+        def select(oCon):
+            if self.postgis is None:
+                self.__execute(oCon, POSTGIS_QUERY)
+                self.postgis=oCon.cursor.fetchone()[0]
+            consulta, values=build_metadata_query(schema, list_tables, self.postgis)
+            self.__execute(oCon, consulta, values)
+            return consulta, oCon.cursor.fetchall()
+        consulta, listaValores=self.__read(select)
         self.query=consulta
-        return listaNombreCampos   
+        dic_tables=decode_metadata(listaValores, list_tables)
+        self.metadata.update(dic_tables)
+        return len([d for d in dic_tables.values() if d['field_names'] is not None])
+
+    def invalidateMetadata(self, table_name=None):
+        """
+        Removes the metadata of a table from the cache, or of all the tables if table_name is None
+        """
+        if table_name is None:
+            self.metadata.clear()
+        else:
+            self.metadata.pop(table_name, None)
 
 class StrFielsAndValuesBase():
     """Class with tree properties uefull to the methods of the class pgOperations"""
@@ -437,6 +2389,11 @@ class StrFielsAndValues(StrFielsAndValuesBase):
         @param d: Dictionary key-value, where the keys are the name fields and the values the value fields of a table. 
             e.g: {"depth":12.15, "description":"water well", "geom":"100 200"}
             Pay attention in the geometry field value at this stage is a string coordinates "x y, x y, ..."
+            The geometry field value can be also a sequence of coordinates, [x, y, x, y, ...] or
+            [(x, y), (x, y), ...], or an array.array('d') or a numpy array. In this case the geometry is
+            converted to WKB, and sent in binary with the expression st_geomfromwkb(%s,25830),
+            so the coordinates are not converted to text
+            e.g: {"depth":12.15, "description":"water well", "geom":[100.0, 200.0]}
         @type list_fields_to_remove: list of strings
         @param list_fields_to_remove: list with the filed names to exclude of the expression. For example ['gid']
             will remove the gid from the expressions and list of values, as this field value is usually 
@@ -474,22 +2431,14 @@ class StrFielsAndValues(StrFielsAndValuesBase):
         
         #adds the geometry type and the paranthesis to the coordinates
         coords=d.get(geom_field_name,'')
-        if coords<>'':#hay geometría
-            if geometry_type=='POLYGON':
-                coords='POLYGON(({coords}))'.format(coords=coords)
-            elif geometry_type=='LINESTRING':
-                coords='LINESTRING({coords})'.format(coords=coords)
-            elif geometry_type=='POINT':
-                coords='POINT({coords})'.format(coords=coords)
-            elif geometry_type=='MULTIPOLYGON':
-                coords='MULTIPOLYGON((({coords})))'.format(coords=coords)
-            elif geometry_type=='MULTILINESTRING':
-                coords='MULTILINESTRING(({coords}))'.format(coords=coords)
-            elif geometry_type=='MULTIPOINT':
-                coords='MULTIPOINT(({coords}))'.format(coords=coords)
-            else:
-                raise Exception("Unsuported geometry type " + geometry_type)
-            d[geom_field_name]=coords
+        wkb=False
+        if not isinstance(coords, basestring):
+            if coords is not None:#sequence of coordinates
+                wkb_value=coords_to_wkb(coords, geometry_type)
+                d[geom_field_name]=None if wkb_value is None else psycopg2.Binary(wkb_value)
+                wkb=True
+        elif coords<>'':#hay geometría
+            d[geom_field_name]=coords_to_wkt(coords, geometry_type)
         
         #forms the tree values returned in the dictionary
         it=d.items()
@@ -507,12 +2456,7 @@ class StrFielsAndValues(StrFielsAndValuesBase):
             if it[i][0] <> geom_field_name:
                 str_s_values=str_s_values + '%s,'
             else:
-                if epsg_to_reproject is None:
-                    st='st_geometryfromtext(%s,{epsg}),'.format(epsg=epsg)
-                    str_s_values=str_s_values + st
-                else:
-                    st='st_transform(st_geometryfromtext(%s,{epsg}),{epsg_to_reproject}),'.format(epsg=epsg, epsg_to_reproject=epsg_to_reproject)
-                    str_s_values=str_s_values + st             
+                str_s_values=str_s_values + geometry_expression(epsg, epsg_to_reproject, wkb) + ','
                 #(%s,st_geometryfromtext(%s,25830))           
         str_name_fields=str_name_fields[:-1]
         str_s_values=str_s_values[:-1]
@@ -521,64 +2465,1288 @@ class StrFielsAndValues(StrFielsAndValuesBase):
         self.list_field_values=list_values
         self.str_s_values=str_s_values
     
-def transform_coords_ol_to_postgis(coords_geom, splitString=','):
+class RowTemplate(object):
     """
-    Receives a string coordinate like 'x,y,x,y,x,y,....' from openlayers
-    Returns a string like 'x y, x y, x y, ....'
+    Template of the rows of a table, with the same fields and the same geometry options.
+    The strings str_field_names and str_s_values are built only once, in the constructor,
+    and the method bind converts each dictionary to a BoundRow, that can be used instead of
+    a StrFielsAndValues object in pgInsert, pgUpdate, pgInsertMany, ... The dictionaries
+    are not copied or modified
+
+    Example of use:
+        oTemplate=pgo.RowTemplate(field_names=['description', 'depth', 'geom'], geom_field_name='geom',
+                                  epsg='25830', geometry_type='POINT', epsg_to_reproject='25831')
+        for d in rows:
+            oOp.pgInsert(nom_tabla='d.points', oStrFielsAndValues=oTemplate.bind(d))
+        #or
+        oOp.pgInsertMany(nom_tabla='d.points', rows=rows, template=oTemplate)
     """
-    lc=coords_geom.split(splitString)
-    n=len(lc)
-    sc=''
-    for i in xrange(0,n,2):#starts in 0, stops in n, step 2
-        #xrange(0,10,2)-->[0,2,4,6,8]
-        x=lc[i]
-        y=lc[i+1]
-        sc=sc + ',' + x + ' ' + y
-    return sc[1:]
+    __slots__=('field_names', 'str_field_names', 'str_s_values', 'geom_index', 'geometry_type', 'wkb')
 
-def transform_coords_land_registry_gml_to_postgis(coords_geom, splitString=' '):
+    def __init__(self, field_names, geom_field_name='geom', epsg='25830', geometry_type='POLYGON',
+                 epsg_to_reproject=None, wkb=False):
+        """
+        @type field_names: list or string
+        @param field_names: list of the field names, or string with the field names comma separated.
+            The missing keys in the dictionaries are bound as null, and the other keys are ignored
+        @type geom_field_name: string
+        @param geom_field_name: name of the geometry field in the table. If it is in field_names,
+            its values are converted to geometries
+        @param epsg: see the class StrFielsAndValues
+        @param geometry_type: see the class StrFielsAndValues
+        @param epsg_to_reproject: see the class StrFielsAndValues
+        @type wkb: boolean
+        @param wkb: if True, the geometries are sent as WKB, and if False, as WKT. The geometries,
+            strings 'x y, x y, ...' or sequences of coordinates, are converted to the format of the template
+        """
+        if isinstance(field_names, basestring):
+            field_names=field_names.split(',')
+        self.field_names=tuple([field.strip() for field in field_names])
+        self.geometry_type=geometry_type
+        self.wkb=wkb
+        self.geom_index=None
+        list_s=[]
+        for i, field in enumerate(self.field_names):
+            if field == geom_field_name:
+                self.geom_index=i
+                list_s.append(geometry_expression(epsg, epsg_to_reproject, wkb))
+            else:
+                list_s.append('%s')
+        self.str_field_names=','.join(self.field_names)
+        self.str_s_values=','.join(list_s)
+
+    def values(self, d):
+        """
+        Returns a tuple with the values of the dictionary d, in the order of the field names.
+        The values '' are converted to None, and the geometry to WKT or WKB
+        """
+        get=d.get
+        values=[get(field) for field in self.field_names]
+        for i, value in enumerate(values):
+            if isinstance(value, basestring) and value == '':
+                values[i]=None
+        i=self.geom_index
+        if i is not None and values[i] is not None:
+            coords=values[i]
+            if self.wkb:
+                if isinstance(coords, basestring):
+                    coords=[float(c) for c in coords.replace(',', ' ').split()]
+                wkb_value=coords_to_wkb(coords, self.geometry_type)
+                values[i]=None if wkb_value is None else psycopg2.Binary(wkb_value)
+            else:
+                if not isinstance(coords, basestring):
+                    coords=pgCoords.format_coords(coords)
+                values[i]=coords_to_wkt(coords, self.geometry_type)
+        return tuple(values)
+
+    def bind(self, d):
+        """
+        Returns a BoundRow with the values of the dictionary d. See the method values
+        """
+        return BoundRow(self.str_field_names, self.values(d), self.str_s_values)
+
+    def bindMany(self, rows):
+        """Returns a generator of BoundRow objects, one for each dictionary of rows"""
+        for d in rows:
+            yield self.bind(d)
+
+class BoundRow(object):
     """
-    Receives a string coordinate like 'x,y x,y x,y,....' from land registry gml
-    Returns a string like 'x y, x y, x y, ....'
+    Row bound with a RowTemplate. It has the same three properties than StrFielsAndValuesBase,
+    so it can be used in the same methods. list_field_values is a tuple
     """
-    
-    coords_geom=coords_geom.replace(' ',',')
-    return transform_coords_ol_to_postgis(coords_geom)
-
-def reverseXY (strCoords, separatorIn, separatorOut): 
-    """
-    Changes the x y order for y x in a string
-    Receives a string with 'x,y,x,y,...' 'or x y x y ...' and retuns a string with 'y,x,y,x,...'
-        or 'y x y x ...'
-    @type  strCoords: string
-    @param strCoords: Coordenates string comma or space separated:
-        'x,y,x,y,...' or 'x y x y ...'
-    @type  separatorIn: string
-    @param separatorIn: Coodinates separator in the input string. Can be ',' or ' '     
-    @type  separatorOut: string
-    @param separatorOut: Coodinates eparator in the output string. Can be ',' or ' '
-    @return: a string with the 'y,x,y,x,...' or 'y x y x ...', depending of the separator
-    
+    __slots__=('str_field_names', 'list_field_values', 'str_s_values')
+
+    def __init__(self, str_field_names, list_field_values, str_s_values):
+        self.str_field_names=str_field_names
+        self.list_field_values=list_field_values
+        self.str_s_values=str_s_values
+
+class pgBatch():
+    """
+    Queue of write operations of the method pgOperations.batch. The methods pgInsert,
+    pgUpdate and pgDelete take the same parameters than the methods of pgOperations,
+    but they only form the statements. At the end of the block all of them are sent
+    to the server in only one round trip, and the results are stored in the properties
+    results and rowcounts
+    """
+    operations=None
+    """List of dictionaries with the operations queued - class variable"""
+    results=None
+    """List with the result of each operation, the same that the method of pgOperations returns - class variable"""
+    rowcounts=None
+    """List with the number of rows affected by each operation - class variable"""
+    def __init__(self):
+        self.operations=[]
+
+    def __append(self, kind, table_name, cons, values, returning, cond_where=None,
+                 list_values_cond_where=None, oStrFielsAndValues=None):
+        self.operations.append({'kind': kind, 'table_name': table_name, 'cons': cons, 'values': values,
+                                'returning': returning, 'cond_where': cond_where,
+                                'list_values_cond_where': list_values_cond_where,
+                                'oStrFielsAndValues': oStrFielsAndValues})
+
+    def pgInsert(self, nom_tabla, oStrFielsAndValues, str_fields_returning=None):
+        """
+        Queues an insert. See pgOperations.pgInsert. The result is the list of tuples
+        of the returning fields, or None if str_fields_returning is None
+        """
+        cons, values, key=build_insert(nom_tabla, oStrFielsAndValues, str_fields_returning)
+        self.__append('insert', nom_tabla, cons, values, str_fields_returning <> None, oStrFielsAndValues=oStrFielsAndValues)
+
+    def pgUpdate(self, table_name, oStrFielsAndValues, cond_where=None, list_values_cond_where=None):
+        """Queues an update. See pgOperations.pgUpdate. The result is the number of updated rows"""
+        cons, values, key=build_update(table_name, oStrFielsAndValues, cond_where, list_values_cond_where)
+        if cond_where is None:
+            oStrFielsAndValues=None
+        self.__append('update', table_name, cons, values, False, cond_where, list_values_cond_where, oStrFielsAndValues)
+
+    def pgDelete(self, table_name, cond_where=None, list_values_cond_where=None):
+        """Queues a delete. See pgOperations.pgDelete. The result is the number of deleted rows"""
+        cons, values, key=build_delete(table_name, cond_where, list_values_cond_where)
+        self.__append('delete', table_name, cons, values, False, cond_where, list_values_cond_where)
+
+def print_hook(template, n_params, rowcount, elapsed):
+    """Hook that prints the statements. See the method pgOperations.addHook"""
+    print 'Query: ' + template
+
+class QueryStatsCollector():
+    """
+    Hook that collects, for each statement template, the number of calls and rows,
+    the latency percentiles and the throughput. See the method pgOperations.addHook
+
     Example of use:
-        s='1,2,1,2,1,2'
-        print reverseXY(s,',',',')
-        '2,1,2,1,2,1'
+        oStats=pgo.QueryStatsCollector()
+        oOp=pgo.pgOperations(oPgConnect=oCon, hooks=[oStats])
+        ...
+        print oStats.report()
     """
- 
-    
-    if separatorIn==',':
-        coords=strCoords.split(',')
-    elif separatorIn==' ':
-        coords=strCoords.split(' ')
-    
-    n=len(coords)
-    r=''
-    for i in xrange(0,n,2):#starts in 0, stops in n, step 2
-        x=coords[i]
-        y=coords[i+1]
-        r=r + y + separatorOut + x + separatorOut
-    return r[:-1]
+    def __init__(self, max_samples=10000):
+        """
+        @type max_samples: integer
+        @param max_samples: maximum number of latencies stored by template. When there are
+            more calls, a random sample of the latencies is kept to compute the percentiles
+        """
+        self.max_samples=max_samples
+        self.lock=threading.Lock()
+        self.templates={}
+
+    def __call__(self, template, n_params, rowcount, elapsed):
+        now=time.time()
+        with self.lock:
+            d=self.templates.get(template)
+            if d is None:
+                d={'calls': 0, 'rows': 0, 'total_time': 0.0, 'max_time': 0.0, 'samples': [], 'first': now - elapsed, 'last': now}
+                self.templates[template]=d
+            d['calls'] += 1
+            if rowcount > 0:
+                d['rows'] += rowcount
+            d['total_time'] += elapsed
+            d['max_time']=max(d['max_time'], elapsed)
+            d['last']=now
+            if len(d['samples']) < self.max_samples:
+                d['samples'].append(elapsed)
+            else:
+                i=random.randint(0, d['calls'] - 1)
+                if i < self.max_samples:
+                    d['samples'][i]=elapsed
+
+    def stats(self):
+        """
+        Returns a dictionary template:statistics. The statistics are a dictionary with the keys
+        calls, rows, total_time, mean, p50, p95, p99, max (seconds), and
+        calls_per_second and rows_per_second, computed between the first and the last call
+        """
+        with self.lock:
+            items=[(template, dict(d, samples=sorted(d['samples']))) for template, d in self.templates.items()]
+        r={}
+        for template, d in items:
+            samples=d['samples']
+            window=d['last'] - d['first']
+            if window <= 0:
+                window=d['total_time'] or 1
+            r[template]={'calls': d['calls'], 'rows': d['rows'], 'total_time': d['total_time'],
+                         'mean': d['total_time']/d['calls'], 'max': d['max_time'],
+                         'p50': percentile(samples, 50), 'p95': percentile(samples, 95), 'p99': percentile(samples, 99),
+                         'calls_per_second': d['calls']/window, 'rows_per_second': d['rows']/window}
+        return r
+
+    def report(self, sort_by='total_time', n=None):
+        """
+        Returns a string with a table of the statistics, one line by template
+        @param sort_by: key of the statistics to sort the templates, descending
+        @param n: maximum number of templates. None to show all of them
+        """
+        stats=sorted(self.stats().items(), key=lambda item: item[1][sort_by], reverse=True)
+        if n is not None:
+            stats=stats[:n]
+        lines=['{0:>8} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}  {7}'.format(
+            'calls', 'total s', 'p50 ms', 'p95 ms', 'p99 ms', 'calls/s', 'rows/s', 'statement')]
+        for template, d in stats:
+            lines.append('{0:>8} {1:>10.3f} {2:>10.3f} {3:>10.3f} {4:>10.3f} {5:>10.1f} {6:>10.1f}  {7}'.format(
+                d['calls'], d['total_time'], d['p50']*1000, d['p95']*1000, d['p99']*1000,
+                d['calls_per_second'], d['rows_per_second'], ' '.join(template.split())))
+        return '\n'.join(lines)
+
+    def reset(self):
+        """Removes the collected statistics"""
+        with self.lock:
+            self.templates={}
+
+def percentile(sorted_values, p):
+    """Returns the percentile p, 0-100, of a sorted list. 0 if the list is empty"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(round(p/100.0*(len(sorted_values) - 1)))]
+
+class PreparedStatementCache():
+    """
+    LRU cache of the statements prepared in a connection. Each connection
+    has to have its own cache, as the prepared statements only exist in the
+    session where they were prepared
+    """
+    statement_counter=itertools.count()
+    """Counter to give a different name to each prepared statement - class variable"""
+    def __init__(self, maxsize):
+        self.maxsize=maxsize
+        self.statements=collections.OrderedDict()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def execute(self, cursor, key, cons, values=None):
+        """
+        Executes the statement cons with the values. If the key is not in the cache
+        the statement is prepared, and the least recently used is deallocated if
+        the cache is full
+        @param key: tuple that identifies the statement
+        @param cons: statement with %s instead of the values
+        @param values: list of the values of the %s
+        """
+        name=self.statements.pop(key, None)
+        if name is None:
+            self.misses += 1
+            name='pgo_stmt_{0}'.format(next(self.statement_counter))
+            #the text of prepare is not interpolated by psycopg2, so the %% are always changed for %
+            cursor.execute('prepare {0} as {1}'.format(name, numbered_params(cons)))
+            while len(self.statements) >= self.maxsize:
+                old_key, old_name=self.statements.popitem(last=False)
+                cursor.execute('deallocate ' + old_name)
+                self.evictions += 1
+        else:
+            self.hits += 1
+        self.statements[key]=name
+        if values:
+            cursor.execute('execute {0} ({1})'.format(name, ','.join(['%s']*len(values))), values)
+        else:
+            cursor.execute('execute ' + name)
+
+class TileCache():
+    """
+    LRU cache of the vector tiles made with the method pgOperations.pgTile, with an
+    optional store in disk. The tiles of a table are invalidated when pgInsert, pgUpdate
+    or pgDelete change rows in their extent, and all of them with the other write methods,
+    after the commit. The tiles can expire too, to not keep for ever a tile read from a
+    replica that was not up to date. It is thread safe
+
+    Example of use:
+        oTileCache=pgo.TileCache(maxsize=10000, directory='/var/cache/tiles')
+        oOp=pgo.pgOperations(oPgConnect=oPool, tile_cache=oTileCache)
+        tile=oOp.pgTile('d.buildings', 15, 16023, 12345)
+    """
+    def __init__(self, maxsize=1000, directory=None, ttl=None):
+        """
+        @type maxsize: integer
+        @param maxsize: maximum number of tiles stored in memory
+        @type directory: string
+        @param directory: directory where the tiles are stored too, in a folder for each table.
+            The tiles removed from memory are read again from the disk. None to not store
+            the tiles in disk
+        @type ttl: float
+        @param ttl: seconds that a tile is valid, in memory and in disk. None to keep the tiles
+            until they are invalidated
+        """
+        self.maxsize=maxsize
+        self.directory=directory
+        self.ttl=ttl
+        self.tiles=collections.OrderedDict()
+        self.geometry_fields={}
+        self.lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.invalidations=0
+
+    def __path(self, key):
+        """Returns the file of a tile in the disk store"""
+        table_name, geom_field_name, z, x, y, margin, params=key
+        name='{0}_{1}_{2}_{3!r}_{4}.mvt'.format(z, x, y, margin, hashlib.md5(repr(params)).hexdigest())
+        return os.path.join(self.directory, table_name, geom_field_name, name)
+
+    def get(self, key):
+        """
+        Returns a tile, or None if it is not in the cache
+        @param key: tuple (table_name, geom_field_name, z, x, y, margin, params). margin is the
+            buffer of the tile, as a fraction of the tile size, and params a tuple with the
+            rest of parameters used to make the tile
+        """
+        now=time.time()
+        with self.lock:
+            item=self.tiles.pop(key, None)
+            if item is not None and (self.ttl is None or now - item[1] <= self.ttl):
+                self.tiles[key]=item
+                self.hits += 1
+                return item[0]
+        if self.directory is not None:
+            try:
+                with open(self.__path(key), 'rb') as f:
+                    created=os.fstat(f.fileno()).st_mtime
+                    tile=f.read()
+            except (IOError, OSError):
+                pass
+            else:
+                if self.ttl is None or now - created <= self.ttl:
+                    self.put(key, tile, store=False, created=created)
+                    with self.lock:
+                        self.hits += 1
+                    return tile
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, tile, store=True, created=None):
+        """
+        Stores a tile. See the method get
+        @param store: if True, the tile is written in the disk store
+        @param created: time when the tile was made, to compute when it expires. None for now
+        """
+        with self.lock:
+            self.geometry_fields.setdefault(key[0], set()).add(key[1])
+            self.tiles.pop(key, None)
+            self.tiles[key]=(tile, time.time() if created is None else created)
+            while len(self.tiles) > self.maxsize:
+                self.tiles.popitem(last=False)
+                self.evictions += 1
+        if store and self.directory is not None:
+            path=self.__path(key)
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    pass
+            #written in other file and renamed, so other threads never read half a tile
+            tmp_path='{0}.{1}.tmp'.format(path, threading.current_thread().ident)
+            with open(tmp_path, 'wb') as f:
+                f.write(tile)
+            os.rename(tmp_path, path)
+
+    def geometryFields(self, table_name):
+        """
+        Returns the list of geometry fields of a table with cached tiles. An empty list if
+        there are not tiles of the table
+        """
+        with self.lock:
+            geometry_fields=set(self.geometry_fields.get(table_name, ()))
+        if self.directory is not None and os.path.isdir(os.path.join(self.directory, table_name)):
+            geometry_fields.update(os.listdir(os.path.join(self.directory, table_name)))
+        return sorted(geometry_fields)
+
+    def invalidate(self, table_name, bbox=None, geom_field_name=None):
+        """
+        Removes the tiles of a table
+        @type bbox: tuple
+        @param bbox: (xmin, ymin, xmax, ymax) in EPSG:3857. Only the tiles that intersect
+            it are removed. None to remove all the tiles of the table
+        @param geom_field_name: only the tiles of this geometry field are removed.
+            None to remove the tiles of all the geometry fields
+        @return: the number of tiles removed from memory and from the disk
+        """
+        n=0
+        with self.lock:
+            for key in self.tiles.keys():
+                if key[0] == table_name and (geom_field_name is None or key[1] == geom_field_name) and \
+                        (bbox is None or tile_intersects(key[2], key[3], key[4], key[5], bbox)):
+                    del self.tiles[key]
+                    n += 1
+        if self.directory is not None:
+            if geom_field_name is None:
+                list_fields=self.geometryFields(table_name)
+            else:
+                list_fields=[geom_field_name]
+            for field in list_fields:
+                directory=os.path.join(self.directory, table_name, field)
+                if not os.path.isdir(directory):
+                    continue
+                for name in os.listdir(directory):
+                    if not name.endswith('.mvt'):
+                        continue
+                    z, x, y, margin=name.split('_')[:4]
+                    if bbox is None or tile_intersects(int(z), int(x), int(y), float(margin), bbox):
+                        try:
+                            os.remove(os.path.join(directory, name))
+                            n += 1
+                        except OSError:
+                            pass
+        with self.lock:
+            self.invalidations += n
+        return n
+
+    def stats(self):
+        """
+        Returns a dictionary with the statistics of the cache: hits, misses, evictions,
+        invalidations and tiles (number of tiles in memory)
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'tiles': len(self.tiles)}
+
+class ResultCache():
+    """
+    LRU cache of the results of the method pgOperations.pgSelect, with a maximum number of
+    results, a maximum memory, and a time to live. The key is the select statement and its
+    values. The write methods of pgOperations remove the results of the table they
+    write. It is thread safe, and it can be shared by several pgOperations objects.
+
+    The writes of other processes are only seen if all of them use the same notification
+    channel: each write sends 'pg_notify(channel, table_name)', and a thread listens the
+    channel and removes the results of the notified tables. The results of a select of
+    several tables, or of a view, are only removed by the ttl
+
+    Example of use:
+        oResultCache=pgo.ResultCache(maxsize=1000, ttl=60, channel='pgo_result_cache')
+        oOp=pgo.pgOperations(oPgConnect=oPool, result_cache=oResultCache)
+        oOp.pgSelect('d.provinces', 'code, name', limit=None)
+        oOp.pgSelect('d.provinces', 'code, name', limit=None) #from the cache
+        print oResultCache.stats()
+        {'hits': 1, 'misses': 1, 'hit_ratio': 0.5, 'entries': 1, 'memory': 1843, 'evictions': 0, 'invalidations': 0}
+    """
+    def __init__(self, maxsize=1000, ttl=60, max_memory=None, channel=None):
+        """
+        @type maxsize: integer
+        @param maxsize: maximum number of stored results
+        @type ttl: float
+        @param ttl: seconds that a result is stored. None to store it until it is
+            invalidated or evicted
+        @type max_memory: integer
+        @param max_memory: maximum bytes of the stored results. None for no limit.
+            The results are stored serialized, so the memory is the size of the serialized results
+        @type channel: string
+        @param channel: name of the channel used with LISTEN/NOTIFY to receive the tables
+            written by other processes. None to not use notifications
+        """
+        self.maxsize=maxsize
+        self.ttl=ttl
+        self.max_memory=max_memory
+        self.channel=channel
+        self.results=collections.OrderedDict()
+        self.keys_by_table={}
+        self.memory=0
+        self.lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.invalidations=0
+        self.listener=None
+        self.closed=False
+
+    def get(self, key):
+        """
+        Returns the result stored with key, or None if it is not in the cache or it has expired.
+        Each call returns a new copy of the result
+        """
+        with self.lock:
+            entry=self.results.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[1] > self.ttl:
+                self.__remove(key)
+                entry=None
+            if entry is None:
+                self.misses += 1
+                return None
+            del self.results[key]
+            self.results[key]=entry
+            self.hits += 1
+        return cPickle.loads(entry[0])
+
+    def put(self, key, table_name, result):
+        """
+        Stores a result
+        @param table_name: the table of the select. The result is removed when the table is written
+        """
+        data=cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        if self.max_memory is not None and len(data) > self.max_memory:
+            return
+        with self.lock:
+            if key in self.results:
+                self.__remove(key)
+            self.results[key]=(data, time.time(), table_name)
+            self.keys_by_table.setdefault(table_name, set()).add(key)
+            self.memory += len(data)
+            while len(self.results) > self.maxsize or (self.max_memory is not None and self.memory > self.max_memory):
+                self.__remove(next(iter(self.results)))
+                self.evictions += 1
+
+    def __remove(self, key):
+        """Removes a result. The lock has to be held"""
+        data, t, table_name=self.results.pop(key)
+        self.memory -= len(data)
+        keys=self.keys_by_table.get(table_name)
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_table[table_name]
+
+    def invalidate(self, table_name=None):
+        """
+        Removes the results of the selects of a table. None to remove all the results
+        @return: the number of removed results
+        """
+        with self.lock:
+            if table_name is None:
+                keys=list(self.results.keys())
+            else:
+                keys=list(self.keys_by_table.get(table_name, ()))
+            for key in keys:
+                self.__remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def listen(self, params):
+        """
+        Starts, if it is not started yet, a thread that listens the notification channel,
+        with its own connection, and removes the results of the notified tables
+        @param params: dictionary with the connection parameters. See pgConnect.params
+        """
+        with self.lock:
+            if self.listener is not None or self.channel is None:
+                return
+            self.listener=threading.Thread(target=self.__listen, args=(params,))
+            self.listener.daemon=True
+        self.listener.start()
+
+    def __listen(self, params):
+        """Body of the thread started by the method listen. Reconnects if the connection is lost"""
+        while not self.closed:
+            try:
+                conn=psycopg2.connect(**params)
+            except psycopg2.Error:
+                time.sleep(1)
+                continue
+            try:
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute('listen "{0}"'.format(self.channel.replace('"', '""')))
+                #the results stored while the connection was not listening may be stale
+                self.invalidate()
+                while not self.closed:
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify=conn.notifies.pop(0)
+                        self.invalidate(notify.payload)
+            except psycopg2.Error:
+                time.sleep(1)
+            finally:
+                conn.close()
+
+    def close(self):
+        """Stops the thread that listens the notification channel"""
+        self.closed=True
+
+    def stats(self):
+        """
+        Returns a dictionary with the statistics of the cache: hits, misses, hit_ratio,
+        entries (number of stored results), memory (bytes of the stored results),
+        evictions and invalidations
+        """
+        with self.lock:
+            calls=self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': float(self.hits)/calls if calls > 0 else 0.0,
+                    'entries': len(self.results), 'memory': self.memory,
+                    'evictions': self.evictions, 'invalidations': self.invalidations}
+
+WEB_MERCATOR_HALF_SIZE=20037508.342789244
+"""Half of the size of the world in EPSG:3857, in meters"""
+
+def tile_envelope(z, x, y, margin=0.0):
+    """
+    Returns the envelope (xmin, ymin, xmax, ymax), in EPSG:3857, of the tile z/x/y of the
+    XYZ tile scheme, the one of OpenLayers, Leaflet, Mapbox, ...
+    @param margin: fraction of the tile size added to each side
+    """
+    size=2*WEB_MERCATOR_HALF_SIZE/(1 << z)
+    xmin=-WEB_MERCATOR_HALF_SIZE + x*size
+    ymax=WEB_MERCATOR_HALF_SIZE - y*size
+    return (xmin - margin*size, ymax - size - margin*size, xmin + size + margin*size, ymax + margin*size)
+
+def tile_intersects(z, x, y, margin, bbox):
+    """Returns True if the tile z/x/y, expanded by margin, intersects the bbox (xmin, ymin, xmax, ymax)"""
+    xmin, ymin, xmax, ymax=tile_envelope(z, x, y, margin)
+    return xmin <= bbox[2] and bbox[0] <= xmax and ymin <= bbox[3] and bbox[1] <= ymax
+
+def build_tile(table_name, geom_field_name, table_srid, list_properties, cond_where, envelope, envelope_margin,
+               layer_name, extent=4096, buffer=64):
+    """
+    Forms the statement of the method pgOperations.pgTile
+    @param cond_where: condition without the word 'where'. '' if there is not condition
+    @param envelope: envelope of the tile in EPSG:3857. See the function tile_envelope
+    @param envelope_margin: envelope of the tile and its buffer, to select the rows
+    @return: a tuple (statement, list of values). The values of cond_where have to be
+        added at the end of the list
+    """
+    list_selects=list(list_properties)
+    list_selects.append('st_asmvtgeom(st_transform(t.{0},3857), st_makeenvelope(%s,%s,%s,%s,3857), %s, %s, true) as {0}'.format(geom_field_name))
+    cond='t.{0} && st_transform(st_makeenvelope(%s,%s,%s,%s,3857),{1})'.format(geom_field_name, table_srid)
+    if cond_where <> '':
+        cond += ' and (' + cond_where + ')'
+    cons="select st_asmvt(q, %s, %s, '{0}') from (select {1} from {2} as t where {3}) as q".format(
+        geom_field_name, ', '.join(list_selects), table_name, cond)
+    values=[layer_name, extent] + list(envelope) + [extent, buffer] + list(envelope_margin)
+    return cons, values
+
+def build_extent_query(table_name, geom_field_name, cond_where=None, list_values_cond_where=None, oStrFielsAndValues=None):
+    """
+    Forms the statement that returns the extent, in EPSG:3857, of the rows that a write
+    operation is going to change: the rows of the table that satisfy cond_where, if it is not
+    None, and the geometry of oStrFielsAndValues, if it is not None
+    @return: a tuple (statement, list of values), or None if the operation does not change geometries
+    """
+    list_selects=[]
+    values=[]
+    if cond_where is not None:
+        list_selects.append('select st_transform(t.{0},3857) as g from {1} as t {2}'.format(geom_field_name, table_name, cond_where))
+        values.extend(list_values_cond_where or [])
+    if oStrFielsAndValues is not None:
+        if geom_field_name not in [field.strip() for field in oStrFielsAndValues.str_field_names.split(',')]:
+            if not list_selects:
+                return None
+        else:
+            list_selects.append('select st_transform(v.{0},3857) as g from (select {1}) as v ({2})'.format(
+                geom_field_name, oStrFielsAndValues.str_s_values, oStrFielsAndValues.str_field_names))
+            values.extend(oStrFielsAndValues.list_field_values)
+    cons='select st_xmin(e), st_ymin(e), st_xmax(e), st_ymax(e) from (select st_extent(g) as e from ({0}) as q) as q'.format(' union all '.join(list_selects))
+    return cons, values
+
+def numbered_params(cons):
+    """
+    Changes the %s of a statement for $1, $2, ..., to use it in 'prepare'
+    The %% are changed for %
+    """
+    counter=itertools.count(1)
+    return re.sub('%%|%s', lambda m: '%' if m.group(0) == '%%' else '${0}'.format(next(counter)), cons)
+
+class IteratorFile():
+    """
+    File like object, to use with the method copy_expert of a psycopg2 cursor,
+    whose content is generated by an iterator of strings. Only the strings
+    needed to fill each read are taken from the iterator
+    """
+    def __init__(self, iterator):
+        self.iterator=iterator
+        self.buffer=''
+
+    def read(self, size=-1):
+        """Returns a string of size characters, or less if the iterator is exhausted"""
+        chunks=[self.buffer]
+        n=len(self.buffer)
+        while size < 0 or n < size:
+            try:
+                s=next(self.iterator)
+            except StopIteration:
+                break
+            chunks.append(s)
+            n += len(s)
+        data=''.join(chunks)
+        if size < 0 or n <= size:
+            self.buffer=''
+            return data
+        self.buffer=data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        """Returns the next line of the content"""
+        while '\n' not in self.buffer:
+            try:
+                self.buffer += next(self.iterator)
+            except StopIteration:
+                break
+        i=self.buffer.find('\n') + 1
+        if i == 0:
+            i=len(self.buffer)
+        if size >= 0:
+            i=min(i, size)
+        line=self.buffer[:i]
+        self.buffer=self.buffer[i:]
+        return line
+
+def build_insert(nom_tabla, oStrFielsAndValues, str_fields_returning=None):
+    """
+    Forms the statement of the method pgOperations.pgInsert
+    @return: a tuple (statement, list of values, key of the statement shape)
+    """
+    str_field_names=oStrFielsAndValues.str_field_names
+    str_s_values=oStrFielsAndValues.str_s_values
+    #cons_ins='insert into {0} ({1}) values (%s,st_geometryfromtext(%s,25830))'.format(nom_tabla, string_fields_to_set)
+    cons_ins='insert into {0} ({1}) values ({2})'.format(nom_tabla, str_field_names, str_s_values)
+    if str_fields_returning <> None:
+        cons_ins =cons_ins + ' returning ' + str_fields_returning
+    return cons_ins, oStrFielsAndValues.list_field_values, ('insert', nom_tabla, str_field_names, str_s_values, str_fields_returning)
+
+def build_update(table_name, oStrFielsAndValues, cond_where=None, list_values_cond_where=None):
+    """
+    Forms the statement of the method pgOperations.pgUpdate
+    @return: a tuple (statement, list of values, key of the statement shape)
+    """
+    str_field_names=oStrFielsAndValues.str_field_names
+    list_field_values=oStrFielsAndValues.list_field_values
+    str_s_values=oStrFielsAndValues.str_s_values
+    cons='update {table_name} set ({str_field_names}) = ({str_s_values})'.format(table_name=table_name,str_field_names=str_field_names,str_s_values=str_s_values)
+    key=('update', table_name, str_field_names, str_s_values, cond_where)
+    if cond_where <> None:
+        cons += ' ' + cond_where
+        return cons, list(list_field_values) + list(list_values_cond_where), key
+    return cons, list_field_values, key
+
+def build_update_many(table_name, oFirst, list_key_fields, field_types, n_rows):
+    """
+    Forms the statement of the method pgOperations.pgUpdateMany, for n_rows rows with
+    the fields and expressions of the StrFielsAndValues object oFirst. The parameters of
+    the 'values' list have not type, so they are casted to the types of the fields of the table
+    @param field_types: dictionary fieldName:type. See pgOperations.getTableMetadata
+    """
+    list_field_names=[field.strip() for field in oFirst.str_field_names.split(',')]
+    for field in list_key_fields + list_field_names:
+        if field not in field_types:
+            raise Exception("The field {0} is not in the table {1}".format(field, table_name))
+    for field in list_key_fields:
+        if field not in list_field_names:
+            raise Exception("The rows do not have the key field " + field)
+    list_set=['{0} = v.{0}::{1}'.format(field, field_types[field]) for field in list_field_names if field not in list_key_fields]
+    if not list_set:
+        raise Exception("The rows do not have fields to update")
+    str_row='(' + oFirst.str_s_values + ')'
+    str_where=' and '.join(['t.{0} = v.{0}::{1}'.format(field, field_types[field]) for field in list_key_fields])
+    return 'update {table_name} as t set {str_set} from (values {str_values}) as v ({str_field_names}) where {str_where}'.format(
+        table_name=table_name, str_set=', '.join(list_set), str_values=','.join([str_row]*n_rows),
+        str_field_names=','.join(list_field_names), str_where=str_where)
+
+def build_delete(table_name, cond_where=None, list_values_cond_where=None):
+    """
+    Forms the statement of the method pgOperations.pgDelete
+    @return: a tuple (statement, list of values or None, key of the statement shape)
+    """
+    cons='delete from {table_name}'.format(table_name=table_name)
+    key=('delete', table_name, cond_where)
+    if cond_where <> None:
+        cons += ' ' + cond_where
+        return cons, list_values_cond_where, key
+    return cons, None, key
+
+def build_batch(operations):
+    """
+    Forms the statements of the method pgOperations.batch. Each operation is executed in
+    a common table expression that stores its number of rows, and its returning rows
+    in json, in the temporary table pgo_batch. The last statement empties the table
+    and returns its rows
+    @param operations: list of operations. See pgBatch.operations
+    @return: a tuple (statements separated by ';', list of values)
+    """
+    list_cons=['create temp table if not exists pgo_batch (n integer, rowcount bigint, returned text) on commit delete rows']
+    values=[]
+    for n, d in enumerate(operations):
+        if d['returning']:
+            list_cons.append('with r as ({0}) insert into pg_temp.pgo_batch select {1}, count(*), json_agg(r)::text from r'.format(d['cons'], n))
+        else:
+            list_cons.append('with r as ({0} returning 1) insert into pg_temp.pgo_batch select {1}, count(*), null from r'.format(d['cons'], n))
+        if d['values']:
+            values.extend(d['values'])
+    list_cons.append('delete from pg_temp.pgo_batch returning n, rowcount, returned')
+    return ';\n'.join(list_cons), values
+
+def decode_batch(rows, operations):
+    """
+    Decodes the rows returned by the statements of build_batch
+    @return: a tuple (list of results, list of rowcounts), in the order of the operations.
+        The results are the same than the methods pgInsert, pgUpdate and pgDelete return.
+        The returning values are decoded from json, so dates and times are strings
+    """
+    results=[]
+    rowcounts=[]
+    for (n, rowcount, returned), d in zip(sorted(rows), operations):
+        rowcounts.append(rowcount)
+        if d['kind'] <> 'insert':
+            results.append(rowcount)
+        elif not d['returning']:
+            results.append(None)
+        elif returned is None:
+            results.append([])
+        else:
+            results.append([tuple(row.values()) for row in json.loads(returned, object_pairs_hook=collections.OrderedDict)])
+    return results, rowcounts
 
+def build_select(table_name, string_fields_to_select, cond_where='', list_val_cond_where=[], limit=100, row_format='json'):
+    """
+    Forms the statement of the method pgOperations.pgSelect
+    @return: a tuple (statement, list of values or None)
+    """
+    str_limit=''
+    if limit is not None:
+        str_limit=' limit {0}'.format(int(limit))
+    if row_format == 'json':
+        cons='SELECT array_to_json(array_agg(registros)) FROM (select {string_fields_to_select} from {table_name} as t {cond_where}{str_limit}) as registros;'.format(string_fields_to_select=string_fields_to_select,table_name=table_name,cond_where=cond_where,str_limit=str_limit)
+    else:
+        cons='select {string_fields_to_select} from {table_name} as t {cond_where}{str_limit}'.format(string_fields_to_select=string_fields_to_select,table_name=table_name,cond_where=cond_where,str_limit=str_limit)
+    if cond_where == '':
+        return cons, None
+    return cons, list_val_cond_where
+
+def decode_select(lista, field_names, row_format='json'):
+    """
+    Converts the rows fetched with the statement of build_select to the result of the
+    method pgOperations.pgSelect
+    @param lista: the rows returned by fetchall
+    @param field_names: the field names of the rows. Not used with the row_format json
+    """
+    if row_format == 'json':
+        r=lista[0][0]
+        if r == None:
+            return None #there wheren't selected rows
+        #in ubuntu 14.04 r is a string, in 16.04 is a list
+        #so if is string i convert it in list to return alwais a list
+        if type(r) is str:
+            r=json.loads(r)
+        return r
+    if len(lista) == 0:
+        return None #there wheren't selected rows
+    if row_format == 'tuple':
+        return lista
+    decode=row_decoder(field_names, row_format)
+    return [decode(row) for row in lista]
+
+def key_fields_list(key_field):
+    """
+    Converts 'gid' or 'province, gid' or ['province', 'gid'] to a list of field names
+    """
+    if isinstance(key_field, basestring):
+        key_field=key_field.split(',')
+    return [field.strip() for field in key_field]
+
+def build_select_page(table_name, string_fields_to_select, list_key_fields, page_size,
+                      cond_where='', list_val_cond_where=[], descending=False, last_key=None):
+    """
+    Forms the statement of the method pgOperations.pgSelectPage. The key fields
+    are selected first, before the fields string_fields_to_select
+    @param last_key: list with the values of the key fields of the last row of the
+        previous page. None for the first page
+    @return: a tuple (statement, list of values or None)
+    """
+    str_keys=', '.join(list_key_fields)
+    list_cond=[]
+    values=[]
+    cond_where=re.sub(r'(?i)^\s*where\s+', '', cond_where).strip()
+    if cond_where <> '':
+        list_cond.append('(' + cond_where + ')')
+        values.extend(list_val_cond_where)
+    if last_key is not None:
+        list_cond.append('({0}) {1} ({2})'.format(str_keys, '<' if descending else '>',
+                                                  ', '.join(['%s']*len(list_key_fields))))
+        values.extend(last_key)
+    str_where=''
+    if list_cond:
+        str_where=' where ' + ' and '.join(list_cond)
+    str_order=', '.join([field + (' desc' if descending else '') for field in list_key_fields])
+    cons='select {str_keys}, {string_fields_to_select} from {table_name} as t{str_where} order by {str_order} limit {page_size}'.format(
+        str_keys=str_keys, string_fields_to_select=string_fields_to_select, table_name=table_name,
+        str_where=str_where, str_order=str_order, page_size=int(page_size))
+    if not values:
+        return cons, None
+    return cons, values
+
+def encode_page_token(list_key_fields, last_key):
+    """
+    Returns the token of the next page of the method pgOperations.pgSelectPage.
+    It is the base64 of a json with the key fields and the values of the last row.
+    The values that are not json types, as dates or decimals, are stored as strings,
+    PostgreSQL converts them to the type of the key field
+    """
+    s=json.dumps({'fields': list_key_fields, 'key': list(last_key)}, default=unicode, separators=(',', ':'))
+    return base64.urlsafe_b64encode(s)
+
+def decode_page_token(cursor_token, list_key_fields):
+    """
+    Returns the list of key values stored in a token made with encode_page_token,
+    or None if cursor_token is None
+    """
+    if cursor_token is None:
+        return None
+    try:
+        d=json.loads(base64.urlsafe_b64decode(str(cursor_token)))
+        fields=d['fields']
+        key=d['key']
+    except (TypeError, ValueError, KeyError):
+        raise Exception("Invalid page token")
+    if fields <> list_key_fields or len(key) <> len(list_key_fields):
+        raise Exception("The page token was made with other key fields: " + ', '.join(fields))
+    return key
+
+def key_ranges(min_max, n_ranges):
+    """
+    Splits the integer values from min to max, both included, in n_ranges ranges
+    @param min_max: a tuple (min, max). (None, None) if there are not values
+    @return: a list of tuples (lower, upper), the lower value included and the upper
+        excluded. The last upper is None
+    """
+    lower, upper=min_max
+    if lower is None:
+        return []
+    if not isinstance(lower, (int, long)) or not isinstance(upper, (int, long)):
+        raise Exception("The key field must be an integer field")
+    upper += 1
+    step=max(1, -(-(upper - lower) // n_ranges))
+    list_ranges=[(a, a + step) for a in xrange(lower, upper, step)]
+    list_ranges[-1]=(list_ranges[-1][0], None)
+    return list_ranges
+
+def export_sink(sink):
+    """
+    Returns a function, to call from several threads, that sends a list of rows to the sink
+    of the method pgOperations.pgParallelExport. The function is called with None at the end
+    """
+    lock=threading.Lock()
+    if hasattr(sink, 'put'):
+        return sink.put
+    elif hasattr(sink, 'write'):
+        def write(rows):
+            if rows is None:
+                return
+            s=''.join(['\t'.join([copy_text_value(value) for value in row]) + '\n' for row in rows])
+            with lock:
+                sink.write(s)
+        return write
+    elif callable(sink):
+        def call(rows):
+            if rows is None:
+                return
+            with lock:
+                sink(rows)
+        return call
+    raise Exception("The sink must be a function, a file or a Queue.Queue")
+
+POSTGIS_QUERY="""select exists (select 1 from pg_catalog.pg_class
+    where relname = 'geometry_columns' and pg_catalog.pg_table_is_visible(oid))"""
+"""Statement that returns True if the database has PostGIS, so it has the view geometry_columns"""
+
+def build_metadata_query(schema=None, list_tables=None, postgis=True):
+    """
+    Forms the statement of the method pgOperations.prefetchMetadata
+    @type postgis: boolean
+    @param postgis: if False, the database has not PostGIS, so the geometry fields are not
+        read from geometry_columns. See POSTGIS_QUERY
+    @return: a tuple (statement, list of values)
+    """
+    if schema is not None:
+        cond="n.nspname = %s"
+        values=[schema]
+    elif list_tables is not None:
+        cond="n.nspname || '.' || c.relname = any(%s)"
+        values=[list(list_tables)]
+    else:
+        raise Exception("The schema or the list of tables is mandatory")
+    if postgis:
+        str_geometry="g.srid, g.type, s.proj4text like '%%+proj=longlat%%'"
+        str_joins="""left join geometry_columns g on g.f_table_schema = n.nspname and g.f_table_name = c.relname and g.f_geometry_column = a.attname
+            left join spatial_ref_sys s on s.srid = g.srid"""
+    else:
+        str_geometry="null::integer, null::text, null::boolean"
+        str_joins=""
+    consulta="""select n.nspname, c.relname, a.attname, pg_catalog.format_type(a.atttypid, a.atttypmod),
+            exists (select 1 from pg_catalog.pg_index i where i.indrelid = c.oid and i.indisprimary and a.attnum = any(i.indkey)),
+            {geometry}
+        from pg_catalog.pg_attribute a
+            join pg_catalog.pg_class c on c.oid = a.attrelid
+            join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+            {joins}
+        where a.attnum > 0 and not a.attisdropped and c.relkind in ('r', 'v', 'm', 'f', 'p') and {cond}
+        order by n.nspname, c.relname, a.attnum""".format(geometry=str_geometry, joins=str_joins, cond=cond)
+    return consulta, values
+
+def decode_metadata(listaValores, list_tables=None):
+    """
+    Converts the rows fetched with the statement of build_metadata_query to a
+    dictionary tableName:metadata. See the method pgOperations.getTableMetadata
+    The tables of list_tables not found have the metadata {'field_names': None}
+    """
+    t=time.time()
+    dic_tables={}
+    for schema_name, table, field, field_type, is_pk, srid, geometry_type, geographic in listaValores:
+        name=schema_name + '.' + table
+        d=dic_tables.get(name)
+        if d is None:
+            d={'field_names': [], 'field_types': {}, 'primary_key': [], 'geometry_fields': {}, 'time': t}
+            dic_tables[name]=d
+        d['field_names'].append(field)
+        d['field_types'][field]=field_type
+        if is_pk:
+            d['primary_key'].append(field)
+        if srid is not None:
+            d['geometry_fields'][field]={'srid': srid, 'type': geometry_type, 'geographic': bool(geographic)}
+    #the tables not found are stored too, to not search them again until the ttl expires
+    if list_tables is not None:
+        for name in list_tables:
+            if name not in dic_tables:
+                dic_tables[name]={'field_names': None, 'time': t}
+    return dic_tables
+
+def field_names_list(d, changeGeomBySt_asgeojosonGeom=True, nomGeometryField='geom', geojson_expression=None):
+    """
+    Returns the list of field names of the method pgOperations.getTableFieldNames,
+    from the metadata of a table
+    @param geojson_expression: expression that replaces the geometry field. None
+        to use st_asgeojson(nomGeometryField)
+    """
+    if d is None or d['field_names'] is None:
+        return None
+    if geojson_expression is None:
+        geojson_expression='st_asgeojson({0})'.format(nomGeometryField)
+    listaNombreCampos=[]
+    for valor in d['field_names']:
+        if changeGeomBySt_asgeojosonGeom:
+            if valor==nomGeometryField:
+                valor=geojson_expression
+        listaNombreCampos.append(valor)
+    return listaNombreCampos
+
+def zoom_tolerance(zoom, geographic=False):
+    """
+    Returns the size of a pixel, at the equator, in the zoom level zoom of a web map
+    with tiles of 256 pixels. It is used as simplification tolerance
+    @param geographic: if True, the size is in degrees. Otherwise in meters
+    """
+    if geographic:
+        return 360.0/(256 << zoom)
+    return 2*WEB_MERCATOR_HALF_SIZE/(256 << zoom)
+
+def zoom_decimal_digits(zoom, geographic=False):
+    """
+    Returns the number of decimal digits of the coordinates needed in the zoom level zoom:
+    the precision is 10 times smaller than the size of a pixel
+    """
+    return max(0, int(math.ceil(-math.log10(zoom_tolerance(zoom, geographic)))) + 1)
+
+def geojson_expression(geom_field_name='geom', simplify_tolerance=None, max_decimal_digits=None):
+    """
+    Returns the expression that converts a geometry field to GeoJSON:
+    st_asgeojson(st_simplifypreservetopology(geom, simplify_tolerance), max_decimal_digits).
+    The simplification is only added if simplify_tolerance is not None, and the number
+    of digits if max_decimal_digits is not None
+    """
+    expression=geom_field_name
+    if simplify_tolerance is not None:
+        expression='st_simplifypreservetopology({0},{1!r})'.format(expression, float(simplify_tolerance))
+    if max_decimal_digits is not None:
+        return 'st_asgeojson({0},{1})'.format(expression, int(max_decimal_digits))
+    return 'st_asgeojson({0})'.format(expression)
+
+def row_decoder(field_names, row_format):
+    """
+    Returns a function that converts the tuples returned by a psycopg2 cursor
+    @type field_names: list
+    @param field_names: the field names of the selected rows, in the same order
+    @type row_format: string
+    @param row_format: 'dict', 'tuple' or 'namedtuple'
+    @return: a function that receives a tuple and returns the row in the format row_format
+    """
+    if row_format == 'dict':
+        return lambda row: dict(itertools.izip(field_names, row))
+    elif row_format == 'tuple':
+        return lambda row: row
+    elif row_format == 'namedtuple':
+        return collections.namedtuple('Row', field_names, rename=True)._make
+    else:
+        raise Exception("Unsuported row format " + row_format)
+
+def text_value(value, encoding='utf-8'):
+    """
+    Converts a value to its text representation in postgres, without the escapes of copy.
+    The lists and tuples are converted to arrays, and the dictionaries to json
+    @param encoding: python name of the client encoding of the connection, used to
+        encode the unicode strings. See psycopg2.extensions.encodings
+    """
+    if isinstance(value, (list, tuple)):
+        return array_literal(value, encoding)
+    elif isinstance(value, dict):
+        return json.dumps(value)
+    elif isinstance(value, unicode):
+        return value.encode(encoding)
+    elif isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, float):
+        return repr(value)
+    elif isinstance(value, (set, frozenset)):
+        raise Exception("Unsuported value for copy: " + repr(value))
+    return str(value)
+
+def array_literal(values, encoding='utf-8'):
+    """
+    Converts a list, or a list of lists, to the text of a postgres array. e.g. '{"1",NULL,"a b"}'
+    @param encoding: see text_value
+    """
+    list_elements=[]
+    for value in values:
+        if value is None:
+            list_elements.append('NULL')
+        elif isinstance(value, (list, tuple)):
+            list_elements.append(array_literal(value, encoding))
+        else:
+            list_elements.append('"' + text_value(value, encoding).replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '{' + ','.join(list_elements) + '}'
+
+def copy_text_value(value, encoding='utf-8'):
+    """
+    Converts a value to the text format of the command 'copy ... from stdin'
+    The values None and '' are converted to null. See text_value
+    @param encoding: see text_value
+    """
+    if value is None or value == '':
+        return '\\N'
+    return text_value(value, encoding).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def coords_to_wkt(coords, geometry_type):
+    """
+    Adds the geometry type and the parenthesis to a string of coordinates
+    @type  coords: string
+    @param coords: string coordinates 'x y, x y, ...'
+    @type  geometry_type: string
+    @param geometry_type: POINT, LINESTRING, POLYGON, MULTIPOINT, MULTILINESTRING, MULTIPOLYGON
+    @return: the WKT string. e.g: 'POLYGON((x y, x y, ...))'
+    """
+    if geometry_type=='POLYGON':
+        return 'POLYGON(({coords}))'.format(coords=coords)
+    elif geometry_type=='LINESTRING':
+        return 'LINESTRING({coords})'.format(coords=coords)
+    elif geometry_type=='POINT':
+        return 'POINT({coords})'.format(coords=coords)
+    elif geometry_type=='MULTIPOLYGON':
+        return 'MULTIPOLYGON((({coords})))'.format(coords=coords)
+    elif geometry_type=='MULTILINESTRING':
+        return 'MULTILINESTRING(({coords}))'.format(coords=coords)
+    elif geometry_type=='MULTIPOINT':
+        return 'MULTIPOINT(({coords}))'.format(coords=coords)
+    else:
+        raise Exception("Unsuported geometry type " + geometry_type)
+
+def staging_select(list_field_names, geom_field_name, epsg_to_reproject=None):
+    """
+    Returns the fields to select from a staging table, with the geometry reprojected
+    to epsg_to_reproject if it is not None
+    """
+    list_select=[]
+    for key in list_field_names:
+        if key == geom_field_name and epsg_to_reproject is not None:
+            list_select.append('st_transform({0},{1})'.format(key, epsg_to_reproject))
+        else:
+            list_select.append(key)
+    return ','.join(list_select)
+
+def build_upsert(table_name, staging_table, list_field_names, list_conflict_fields, list_update_fields,
+                 skip_unchanged=True, geom_field_name='geom', epsg_to_reproject=None):
+    """
+    Forms the statement of the method pgOperations.pgUpsertMany, that merges the
+    rows of staging_table in table_name. The statement returns a row with the number
+    of inserted rows and the number of updated rows. The inserted rows are the ones
+    with xmax = 0, as they have not been locked by the 'on conflict do update'
+    """
+    str_field_names=','.join(list_field_names)
+    cons='insert into {0} as t ({1}) select {2} from {3} on conflict ({4}) do '.format(
+        table_name, str_field_names, staging_select(list_field_names, geom_field_name, epsg_to_reproject),
+        staging_table, ','.join(list_conflict_fields))
+    if not list_update_fields:
+        cons += 'nothing'
+    else:
+        cons += 'update set ' + ', '.join(['{0} = excluded.{0}'.format(field) for field in list_update_fields])
+        if skip_unchanged:
+            def compared(prefix, field):
+                if field == geom_field_name:
+                    return 'st_asbinary({0}.{1})'.format(prefix, field)
+                return prefix + '.' + field
+            cons += ' where ({0}) is distinct from ({1})'.format(
+                ', '.join([compared('t', field) for field in list_update_fields]),
+                ', '.join([compared('excluded', field) for field in list_update_fields]))
+    return 'with r as ({0} returning xmax = 0 as inserted) select count(*) filter (where inserted), count(*) filter (where not inserted) from r'.format(cons)
+
+def geometry_expression(epsg, epsg_to_reproject=None, wkb=False):
+    """
+    Returns the expression to create a geometry from a %s value
+    @param epsg: epsg code of the coordinates. e.g "25830"
+    @param epsg_to_reproject: epsg code to reproject the geometry, None to not reproject
+    @param wkb: True if the value is WKB, False if it is WKT
+    @return: e.g 'st_transform(st_geometryfromtext(%s,25830),25831)'
+    """
+    if wkb:
+        st='st_geomfromwkb(%s,{epsg})'.format(epsg=epsg)
+    else:
+        st='st_geometryfromtext(%s,{epsg})'.format(epsg=epsg)
+    if epsg_to_reproject is not None:
+        st='st_transform({st},{epsg_to_reproject})'.format(st=st, epsg_to_reproject=epsg_to_reproject)
+    return st
+
+WKB_TYPES={'POINT': 1, 'LINESTRING': 2, 'POLYGON': 3, 'MULTIPOINT': 4, 'MULTILINESTRING': 5, 'MULTIPOLYGON': 6}
+"""Codes of the geometry types in WKB"""
+
+def coords_to_wkb(coords, geometry_type, srid=None):
+    """
+    Packs a sequence of coordinates in little endian WKB. The rings and parts are the same
+    than in the function coords_to_wkt: one ring polygons, and multigeometries of one part,
+    except MULTIPOINT, where each coordinate pair is a point
+    @param coords: [x, y, x, y, ...], [(x, y), (x, y), ...], array.array('d') or numpy array
+    @type  geometry_type: string
+    @param geometry_type: POINT, LINESTRING, POLYGON, MULTIPOINT, MULTILINESTRING, MULTIPOLYGON
+    @type srid: integer
+    @param srid: if it is not None, returns EWKB with this srid
+    @return: a string with the binary WKB. None if there are not coordinates, as the empty
+        string in coords_to_wkt, so the geometry is null
+    """
+    code=WKB_TYPES.get(geometry_type)
+    if code is None:
+        raise Exception("Unsuported geometry type " + geometry_type)
+    if srid is None:
+        header=struct.pack('<BI', 1, code)
+    else:
+        header=struct.pack('<BII', 1, code | 0x20000000, srid)
+    if numpy is not None and isinstance(coords, numpy.ndarray):
+        values=numpy.ascontiguousarray(coords, dtype='<f8').ravel()
+        n=len(values)/2
+        data=values.tostring()
+    else:
+        if not isinstance(coords, array.array):
+            if len(coords) and isinstance(coords[0], (tuple, list)):
+                coords=itertools.chain.from_iterable(coords)
+            coords=array.array('d', coords)
+        elif coords.typecode <> 'd':
+            coords=array.array('d', coords)
+        if sys.byteorder <> 'little':
+            coords=array.array('d', coords)
+            coords.byteswap()
+        n=len(coords)/2
+        data=coords.tostring()
+    if n == 0:
+        return None
+    if geometry_type=='POINT':
+        return header + data
+    elif geometry_type=='LINESTRING':
+        return header + struct.pack('<I', n) + data
+    elif geometry_type=='POLYGON':
+        return header + struct.pack('<II', 1, n) + data
+    elif geometry_type=='MULTIPOINT':
+        point=struct.pack('<BI', 1, WKB_TYPES['POINT'])
+        parts=[header, struct.pack('<I', n)]
+        for i in xrange(n):
+            parts.append(point)
+            parts.append(data[i*16:(i + 1)*16])
+        return ''.join(parts)
+    elif geometry_type=='MULTILINESTRING':
+        return header + struct.pack('<IBII', 1, 1, WKB_TYPES['LINESTRING'], n) + data
+    else:
+        return header + struct.pack('<IBIII', 1, 1, WKB_TYPES['POLYGON'], 1, n) + data
 
 def createDatabase(dbs):
     """
@@ -153,4 +153,76 @@ def select():
 
     """
 
+def coords():
+    #Checks the coordinate converters against the outputs of their first
+    #implementation, with the python and numpy backends. Needs no database
+    import pgCoords as pgc
+
+    def old_ol_to_postgis(coords_geom, splitString=','):
+        lc=coords_geom.split(splitString)
+        sc=''
+        for i in range(0, len(lc), 2):
+            sc=sc + ',' + lc[i] + ' ' + lc[i+1]
+        return sc[1:]
+
+    def old_gml_to_postgis(coords_geom, splitString=' '):
+        return old_ol_to_postgis(coords_geom.replace(splitString, ','), ',')
+
+    def old_reverseXY(strCoords, separatorIn, separatorOut):
+        lc=strCoords.split(separatorIn)
+        r=''
+        for i in range(0, len(lc), 2):
+            r=r + lc[i+1] + separatorOut + lc[i] + separatorOut
+        return r[:-1]
+
+    def numbers(s):
+        #the numpy backend writes 100 as 100.0
+        return [float(c) for c in s.replace(',', ' ').split()]
+
+    ol=['-673652.157623927,202.793645345479,-673449.363930927,304.189446432685', '1,2', '100,-200.5,3.25,4']
+    gml=['-673652.157623927,202.793645345479 -673449.363930927,304.189446432685', '1,2', '100,-200.5 3.25,4']
+    backends=['python']
+    if pgc.numpy is not None:
+        backends.append('numpy')
+
+    for backend in backends:
+        for s in ol:
+            r=pgc.transform_coords_ol_to_postgis(s, ',', backend)
+            assert numbers(r) == numbers(old_ol_to_postgis(s))
+            assert r.count(',') == old_ol_to_postgis(s).count(',')
+            r=pgc.reverseXY(s, ',', ' ', backend)
+            assert numbers(r) == numbers(old_reverseXY(s, ',', ' '))
+        for s in gml:
+            r=pgc.transform_coords_land_registry_gml_to_postgis(s, ' ', backend)
+            assert numbers(r) == numbers(old_gml_to_postgis(s))
+            assert r.count(',') == old_gml_to_postgis(s).count(',')
+        assert map(numbers, pgc.transform_coords_ol_to_postgis_batch(ol, ',', backend)) == [numbers(old_ol_to_postgis(s)) for s in ol]
+        assert map(numbers, pgc.transform_coords_land_registry_gml_to_postgis_batch(gml, ' ', backend)) == [numbers(old_gml_to_postgis(s)) for s in gml]
+        assert map(numbers, pgc.reverseXY_batch(ol, ',', ' ', backend)) == [numbers(old_reverseXY(s, ',', ' ')) for s in ol]
+        #an odd number of coordinates raises, as before
+        for f, s in [(pgc.transform_coords_ol_to_postgis, '1,2,3'), (pgc.transform_coords_land_registry_gml_to_postgis, '1,2 3')]:
+            try:
+                f(s, backend=backend)
+            except Exception:
+                pass
+            else:
+                raise AssertionError("{0} accepted {1}".format(f.__name__, s))
+        try:
+            pgc.reverseXY('1,2,3', ',', ',', backend)
+        except Exception:
+            pass
+        else:
+            raise AssertionError("reverseXY accepted 1,2,3")
+    #the python backend keeps the original text of the numbers
+    assert pgc.transform_coords_ol_to_postgis(ol[2]) == old_ol_to_postgis(ol[2])
+    assert pgc.transform_coords_land_registry_gml_to_postgis(gml[2]) == old_gml_to_postgis(gml[2])
+    assert pgc.reverseXY(ol[2], ',', ' ') == old_reverseXY(ol[2], ',', ' ')
+    print 'Coordinate converters ok with the backends', backends
+
+    """
+    Result
+
+    Coordinate converters ok with the backends ['python', 'numpy']
+    """
+
 select()   
\ No newline at end of file